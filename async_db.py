@@ -0,0 +1,63 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import link_store
+import profiles
+import write_behind
+from config import DB_EXECUTOR_WORKERS
+
+# Async facade over db.py and link_store for the bot handlers. The blocking
+# SQLite and link-log I/O runs on a dedicated thread pool, so a slow disk
+# write never stalls the event loop. Each worker thread gets its own SQLite
+# connection from db.get_connection().
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix='db')
+
+async def run(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+# Users, points and the admin flag go through the profile cache, which
+# writes points through the write-behind buffer. Even cache hits hop to the
+# executor, since the buffer lock is held while a batch commits.
+async def add_user(telegram_id, username, is_admin=0):
+    return await run(profiles.add_user, telegram_id, username, is_admin)
+
+async def update_points(telegram_id, delta):
+    return await run(profiles.update_points, telegram_id, delta)
+
+# Durable on return; for payments
+async def credit_points(telegram_id, delta):
+    return await run(profiles.credit_points, telegram_id, delta)
+
+async def get_points(telegram_id):
+    return await run(profiles.get_points, telegram_id)
+
+async def is_admin(telegram_id):
+    return await run(profiles.is_admin, telegram_id)
+
+# Profile (points, is_admin) or None if the user isn't verified
+async def get_profile(telegram_id):
+    return await run(profiles.get_profile, telegram_id)
+
+async def add_viewed_link(user_id, link_id):
+    return await run(write_behind.add_viewed_link, user_id, link_id)
+
+async def get_next_link_id():
+    return await run(link_store.get_next_link_id)
+
+async def add_link(link):
+    return await run(link_store.add_link, link)
+
+def _next_link_for_user(user_id, last_type):
+    # Viewed checks are per-link indexed lookups as the cursor advances, so
+    # the user's whole history is never loaded
+    viewed = write_behind.ViewedLinks(user_id)
+    return link_store.get_next_link_for_user(user_id, viewed, last_type)
+
+# Returns (link, link_type) or (None, None)
+async def next_link_for_user(user_id, last_type='user'):
+    return await run(_next_link_for_user, user_id, last_type)
+
+def shutdown():
+    _executor.shutdown(wait=True)
@@ -1,20 +1,15 @@
 import logging
 import re
-try:
-    import nest_asyncio
-    nest_asyncio.apply()
-except ImportError:
-    pass
 
 import os
 import sys
 import logging
-from glob import glob
 try:
-    from gdrive_backup import upload_or_update
+    from gdrive_backup import enqueue_backup, format_backup_stats
 except Exception as e:
     logging.error(f"Failed to import gdrive_backup: {e}")
-    upload_or_update = None
+    enqueue_backup = None
+    format_backup_stats = None
 
 # Startup checks for required files
 REQUIRED_FILES = [
@@ -32,12 +27,21 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFi
 from telegram.ext import (
     ApplicationBuilder, CommandHandler, MessageHandler, filters, CallbackQueryHandler, ContextTypes, ConversationHandler
 )
-from config import BOT_TOKEN, ADMINS, ALLOWED_DOMAINS, YOUTUBE_SCREENSHOT_GUIDE_LINK, YOUTUBE_LINK_GUIDE_LINK, YOUTUBE_CHANNEL_LINK, TELEGRAM_CHANNEL_LINK
-from db import init_db, add_user, update_points, get_points, is_admin, add_viewed_link, get_viewed_links
-from ocr_utils import extract_fields_from_image
-from link_store import add_link, get_random_link
+from config import BOT_TOKEN, ADMINS, ALLOWED_DOMAINS, YOUTUBE_SCREENSHOT_GUIDE_LINK, YOUTUBE_LINK_GUIDE_LINK, YOUTUBE_CHANNEL_LINK, TELEGRAM_CHANNEL_LINK, OCR_FAST_PHOTO_MIN_SIDE, OCR_WARM_UP, MEMBERSHIP_REVERIFY_SECONDS, BOT_MODE, WEBHOOK_URL, TELEGRAM_BASE_URL, TELEGRAM_BASE_FILE_URL
+from db import init_db, snapshot_db, close_connections
+import ocr_service
+import ocr_cache
+import membership
+from link_store import init_link_store
+from link_backup import schedule_link_backup
+import async_db
+from send_scheduler import SendRateLimiter, delete_messages, show_typing
+from update_processor import PerUserUpdateProcessor
+import write_behind
+import asyncio
 import datetime
 import json
+import signal
 
 from payment_utils import get_invoice, precheckout_callback, successful_payment
 
@@ -51,10 +55,9 @@ user_states = {}
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     chat_id = user.id
-    # Check if user is a member of the required channel
+    # Check if user is a member of the required channel (cached)
     try:
-        member = await context.bot.get_chat_member(TELEGRAM_CHANNEL_LINK, chat_id)
-        if member.status in ["member", "administrator", "creator"]:
+        if await membership.is_member(context.bot, chat_id):
             # User is a member, proceed as normal
             keyboard = [
                 [InlineKeyboardButton('✅ Yes', callback_data='accept_rules_yes'), InlineKeyboardButton('❌ No', callback_data='accept_rules_no')]
@@ -94,9 +97,10 @@ async def check_channel_joined_callback(update: Update, context: ContextTypes.DE
     await query.answer()
     user = query.from_user
     chat_id = user.id
+    # They say they joined: drop the cached answer and ask Telegram again
+    membership.invalidate(chat_id)
     try:
-        member = await context.bot.get_chat_member(TELEGRAM_CHANNEL_LINK, chat_id)
-        if member.status in ["member", "administrator", "creator"]:
+        if await membership.is_member(context.bot, chat_id):
             # User is now a member, proceed
             keyboard = [
                 [InlineKeyboardButton('✅ Yes', callback_data='accept_rules_yes'), InlineKeyboardButton('❌ No', callback_data='accept_rules_no')]
@@ -143,27 +147,67 @@ async def rules_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text('❌ You must accept the rules to use this bot.')
         return ConversationHandler.END
 
+def pick_ocr_photo(photos):
+    # Smallest size still large enough to read; photos are sorted small to large
+    for photo in photos:
+        if max(photo.width, photo.height) >= OCR_FAST_PHOTO_MIN_SIDE:
+            return photo
+    return photos[-1]
+
+async def download_photo(photo):
+    file = await photo.get_file()
+    # Keep the photo in memory; the OCR worker decodes the bytes directly
+    return bytes(await file.download_as_bytearray())
+
 async def handle_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message.photo:
         await update.message.reply_text('⚠️ Please send a screenshot photo from your Opera News app.')
         return SCREENSHOT
     await update.message.reply_text('⏳ Processing...')
-    photo = update.message.photo[-1]
-    file = await photo.get_file()
-    file_path = f"temp_{update.message.from_user.id}.jpg"
-    await file.download_to_drive(file_path)
-    success, found = extract_fields_from_image(file_path)
-    os.remove(file_path)
+    user_id = update.message.from_user.id
+    photos = update.message.photo
+    photo = pick_ocr_photo(photos)
+    try:
+        image_bytes = await download_photo(photo)
+        # Only the very same file from another account is rejected; a matching
+        # perceptual hash is just flagged, as different accounts' screens look alike
+        if await async_db.run(ocr_cache.reused_by_other_accounts, image_bytes, photo.file_unique_id, user_id):
+            await update.message.reply_text('❌ This screenshot was already used by another account. Please send a screenshot from your own Opera News app.')
+            return SCREENSHOT
+        phash = await async_db.run(ocr_cache.image_hash, image_bytes)
+        await async_db.run(ocr_cache.flag_similar_screenshots, phash, user_id)
+        cached = await async_db.run(ocr_cache.lookup, phash, user_id)
+        if cached:
+            success, found = cached
+        else:
+            # Downscaled pass on the smaller photo first. If it misses a field,
+            # retry on the full-size photo rather than the same small one.
+            larger = photo is not photos[-1]
+            success, found = await ocr_service.extract_fields(image_bytes, fast=True, full_pass=not larger)
+            if not success and larger:
+                success, found = await ocr_service.extract_fields(await download_photo(photos[-1]), fast=False)
+            await async_db.run(ocr_cache.store, phash, user_id, success, found)
+    except ocr_service.OCRBusyError:
+        await update.message.reply_text('⏳ Verification is busy right now. Please send your screenshot again in a minute.')
+        return SCREENSHOT
+    except asyncio.TimeoutError:
+        await update.message.reply_text('⌛ Verification took too long. Please send your screenshot again.')
+        return SCREENSHOT
+    except Exception as e:
+        # Undecodable image, a crashed OCR worker, a failed download...
+        logging.exception(f"Screenshot verification failed for {user_id}: {e}")
+        await update.message.reply_text('⚠️ Something went wrong while checking your screenshot. Please send it again.')
+        return SCREENSHOT
     if success:
         user = update.message.from_user
-        add_user(user.id, user.username, is_admin=int(user.id in ADMINS))
-        await update.message.reply_text('🎉 Hurray! You passed verification. You can now help others and get help!')
-        return await show_main_menu(update, context)
+        await async_db.add_user(user.id, user.username, is_admin=int(user.id in ADMINS))
+        return await show_main_menu(update, context, '🎉 Hurray! You passed verification. You can now help others and get help!')
     else:
         await update.message.reply_text('❌ Could not verify your screenshot. Please try again.')
         return SCREENSHOT
 
-async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE, text='Main Menu:'):
+    # `text` lets a handler send its result and the menu as one message
     keyboard = [
         [KeyboardButton('Post Link'), KeyboardButton('Gain Points')],
         [KeyboardButton('Buy Points'), KeyboardButton('Explore YT')],
@@ -171,10 +215,10 @@ async def show_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
     if update.message:
-        await update.message.reply_text('Main Menu:', reply_markup=reply_markup)
+        await update.message.reply_text(text, reply_markup=reply_markup)
     else:
         await update.callback_query.edit_message_text('Main Menu:')
-        await update.callback_query.message.reply_text('Main Menu:', reply_markup=reply_markup)
+        await update.callback_query.message.reply_text(text, reply_markup=reply_markup)
     return MAIN_MENU
 
 async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -187,49 +231,43 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if text == 'Back to Menu':
             context.user_data['expecting_post_link'] = False
             return await show_main_menu(update, context)
-        processing_msg = await update.message.reply_text('⏳ Processing...')
         url = text.strip()
         if not (url.startswith('https://opr.news/') or 'operanewsapp.com' in url):
-            await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
             await update.message.reply_text('Please send a valid Opera News link (short or long format).')
             return
         user = update.message.from_user
-        admin = is_admin(user.id)
-        points = get_points(user.id)
+        await show_typing(context.bot, update.message.chat_id)
+        profile = await async_db.get_profile(user.id)
+        admin = profile.is_admin if profile else False
+        points = profile.points if profile else None
         if not admin and (points is None or points < 1):
-            await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
-            await update.message.reply_text('Not enough points to post a link. You need at least 1 point.')
             context.user_data['expecting_post_link'] = False
-            return await show_main_menu(update, context)
+            return await show_main_menu(update, context, 'Not enough points to post a link. You need at least 1 point.')
         if not admin:
-            update_points(user.id, -1)
-        from link_store import normalize_opera_link, get_next_link_id, add_link
+            await async_db.update_points(user.id, -1)
+        from link_store import normalize_opera_link
         short_url = normalize_opera_link(url)
-        link_id = get_next_link_id()
-        add_link({
+        link_id = await async_db.get_next_link_id()
+        await async_db.add_link({
             'id': link_id,
             'url': short_url,
             'user_id': user.id,
             'timestamp': datetime.datetime.now().isoformat(),
             'is_admin': admin
         })
-        # After adding a link, update all links_*.json files in Google Drive
-        for json_file in glob('links*.json'):
-            upload_or_update(os.path.basename(json_file), os.path.abspath(json_file), folder_id=GDRIVE_FOLDER_ID)
+        # Back up only the new links; posts in a burst share one upload
+        if enqueue_backup:
+            schedule_link_backup(GDRIVE_FOLDER_ID)
         context.user_data['expecting_post_link'] = False
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
-        await update.message.reply_text(f'Link posted!')
-        return await show_main_menu(update, context)
+        return await show_main_menu(update, context, 'Link posted!')
 
     if text == 'Post Link':
-        processing_msg = await update.message.reply_text('⏳ Processing...')
         context.user_data['expecting_post_link'] = True
         post_msg = (
             "🔗 To post your Opera News link, copy the link from the Opera News app and send it here.\n\n"
             "If you don't know how to get your link, watch this video guide: "
             f"{YOUTUBE_LINK_GUIDE_LINK}"
         )
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
         await update.message.reply_text(post_msg, reply_markup=back_keyboard)
         return
     elif text == 'Gain Points':
@@ -249,127 +287,91 @@ async def main_menu_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(rules, reply_markup=InlineKeyboardMarkup(keyboard))
         return GAIN_POINTS
     elif text == 'Buy Points':
-        processing_msg = await update.message.reply_text('⏳ Processing...')
         invoice = get_invoice()
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
         await update.message.reply_invoice(**invoice)
         return MAIN_MENU
     elif text == 'Explore YT':
-        processing_msg = await update.message.reply_text('⏳ Processing...')
         motivational_msg = (
             "📰 Want to become a better news writer?\n\n"
             "👉 Visit our YouTube channel to learn how to write and publish your own news in seconds, get tips for stress-free writing, and discover secrets every news writer should know!\n"
             "🎥 Click below to explore and grow your skills!"
         )
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
         await update.message.reply_text(f"{motivational_msg}\n{YOUTUBE_CHANNEL_LINK}", reply_markup=back_keyboard)
         return MAIN_MENU
     elif text == 'View My Points':
-        processing_msg = await update.message.reply_text('⏳ Processing...')
-        points = get_points(update.effective_user.id)
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
+        points = await async_db.get_points(update.effective_user.id)
         await update.message.reply_text(f"You have {points or 0:.1f} points.", reply_markup=back_keyboard)
         return MAIN_MENU
     elif text == 'Back to Menu':
-        processing_msg = await update.message.reply_text('⏳ Processing...')
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
         return await show_main_menu(update, context)
     else:
-        processing_msg = await update.message.reply_text('⏳ Processing...')
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
         await update.message.reply_text('Please use the menu.', reply_markup=back_keyboard)
         return MAIN_MENU
 
 
 
+async def pick_next_link(context: ContextTypes.DEFAULT_TYPE, user_id):
+    # Next unseen link for this user, alternating admin/user via last_link_type
+    last_type = context.user_data.get('last_link_type', 'user')
+    link, link_type = await async_db.next_link_for_user(user_id, last_type)
+    if link:
+        context.user_data['last_link_type'] = link_type
+    return link
+
 async def gain_points_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
     import random
     text = update.message.text.strip()
     if text == 'Back to Menu':
         return await show_main_menu(update, context)
-    processing_msg = await update.message.reply_text('⏳ Processing...')
+    chat_id = update.message.chat_id
     start = context.user_data.get('timer_start')
-    if not start:
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
-        await update.message.reply_text('No link in progress.')
-        return await show_main_menu(update, context)
     link = context.user_data.get('current_link')
-    if not link:
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
-        await update.message.reply_text('No link in progress.')
-        return await show_main_menu(update, context)
+    if not start or not link:
+        return await show_main_menu(update, context, 'No link in progress.')
+    await show_typing(context.bot, chat_id)
     # Check time spent
-    timer_start = context.user_data.get('timer_start')
     now = datetime.datetime.now()
-    elapsed = (now - timer_start).total_seconds()
+    elapsed = (now - start).total_seconds()
     required = context.user_data.get('required_seconds')
     if not required:
         required = random.randint(60, 90)
         context.user_data['required_seconds'] = required
+    # Previous link messages are removed together once the new ones are out
+    old_message_ids = context.user_data.pop('last_link_message_ids', [])
+    keyboard = ReplyKeyboardMarkup([[KeyboardButton("I'm done")],[KeyboardButton('Back to Menu')]], resize_keyboard=True)
     if elapsed >= required:
-        add_viewed_link(update.effective_user.id, link.get('id'))
-        update_points(update.effective_user.id, 0.1)
-        points = get_points(update.effective_user.id)
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
-        # Clean up any previous link messages
-        for msg_id in context.user_data.get('last_link_message_ids', []):
-            try:
-                await context.bot.delete_message(chat_id=update.message.chat_id, message_id=msg_id)
-            except Exception:
-                pass
-        context.user_data.pop('last_link_message_ids', None)
-        await update.message.reply_text(f'✅ Your view has been verified and points have been added! You now have {points:.1f} points.')
+        await async_db.add_viewed_link(update.effective_user.id, link.id)
+        await async_db.update_points(update.effective_user.id, 0.1)
+        points = await async_db.get_points(update.effective_user.id)
+        verified = f'✅ Your view has been verified and points have been added! You now have {points:.1f} points.'
         # Prepare for next link
-        from link_store import get_next_alternating_link
-        viewed = get_viewed_links(update.effective_user.id)
-        last_type = context.user_data.get('last_link_type', 'user')
-        link_lists = get_next_alternating_link(update.effective_user.id, viewed)
         # Alternate: if last was user, show admin if available, else user; if last was admin, show user if available, else admin
-        next_link = None
-        if link_lists:
-            if last_type == 'user' and link_lists['admin']:
-                next_link = link_lists['admin'][0]
-                context.user_data['last_link_type'] = 'admin'
-            elif last_type == 'admin' and link_lists['user']:
-                next_link = link_lists['user'][0]
-                context.user_data['last_link_type'] = 'user'
-            elif link_lists['admin']:
-                next_link = link_lists['admin'][0]
-                context.user_data['last_link_type'] = 'admin'
-            elif link_lists['user']:
-                next_link = link_lists['user'][0]
-                context.user_data['last_link_type'] = 'user'
+        next_link = await pick_next_link(context, update.effective_user.id)
         if next_link:
             context.user_data['current_link'] = next_link
             context.user_data['timer_start'] = datetime.datetime.now()
-            keyboard = ReplyKeyboardMarkup([[KeyboardButton("I'm done")],[KeyboardButton('Back to Menu')]], resize_keyboard=True)
-            sent_link_msg = await update.message.reply_text(f"Visit this link: {next_link.get('url', 'No link available')}", reply_markup=keyboard)
-            sent_info_msg = await update.message.reply_text('When you are done, press "I\'m done".', reply_markup=keyboard)
-            context.user_data['last_link_message_ids'] = [sent_link_msg.message_id, sent_info_msg.message_id]
+            sent = await update.message.reply_text(
+                f"{verified}\n\nVisit this link: {next_link.url}\n\nWhen you are done, press \"I'm done\".", reply_markup=keyboard)
+            context.user_data['last_link_message_ids'] = [sent.message_id]
+            await delete_messages(context.bot, chat_id, old_message_ids)
             return GAIN_POINTS
         else:
             # No more links, inform user and clear state, but do NOT force main menu loop
             context.user_data.pop('current_link', None)
             context.user_data.pop('timer_start', None)
             context.user_data.pop('required_seconds', None)
-            await update.message.reply_text('🎉 No more links available right now. Returning to manu......', reply_markup=ReplyKeyboardMarkup([[KeyboardButton('Post Link'), KeyboardButton('Gain Points')],[KeyboardButton('Buy Points'), KeyboardButton('Explore YT')],[KeyboardButton('View My Points')]], resize_keyboard=True))
+            await update.message.reply_text(f'{verified}\n\n🎉 No more links available right now. Returning to manu......', reply_markup=ReplyKeyboardMarkup([[KeyboardButton('Post Link'), KeyboardButton('Gain Points')],[KeyboardButton('Buy Points'), KeyboardButton('Explore YT')],[KeyboardButton('View My Points')]], resize_keyboard=True))
+            await delete_messages(context.bot, chat_id, old_message_ids)
             # Do not return show_main_menu, just return MAIN_MENU so user can choose freely
             return MAIN_MENU
     else:
-        await context.bot.delete_message(chat_id=update.message.chat_id, message_id=processing_msg.message_id)
-        keyboard = ReplyKeyboardMarkup([[KeyboardButton("I'm done")],[KeyboardButton('Back to Menu')]], resize_keyboard=True)
-        warn_msg = await update.message.reply_text('⚠️ Please stay on the page for at least 1 minute so your view is counted.', reply_markup=keyboard)
-        # Add a split/space for clarity
-        split_msg = await update.message.reply_text('------------------------------', reply_markup=keyboard)
-        sent_link_msg = await update.message.reply_text(f"Visit this link: {link.get('url', 'No link available')}", reply_markup=keyboard)
-        sent_info_msg = await update.message.reply_text('When you are done, press "I\'m done".', reply_markup=keyboard)
-        context.user_data['last_link_message_ids'] = [warn_msg.message_id, split_msg.message_id, sent_link_msg.message_id, sent_info_msg.message_id]
-        # Now delete the old link messages (after sending new ones)
-        for msg_id in context.user_data.get('last_link_message_ids', [])[:-4]:
-            try:
-                await context.bot.delete_message(chat_id=update.message.chat_id, message_id=msg_id)
-            except Exception:
-                pass
+        # Warning, link and instructions in one message instead of four
+        sent = await update.message.reply_text(
+            '⚠️ Please stay on the page for at least 1 minute so your view is counted.\n'
+            '------------------------------\n'
+            f"Visit this link: {link.url}\n\nWhen you are done, press \"I'm done\".", reply_markup=keyboard)
+        context.user_data['last_link_message_ids'] = [sent.message_id]
+        await delete_messages(context.bot, chat_id, old_message_ids)
         return GAIN_POINTS
 
 async def fallback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -385,15 +387,25 @@ async def fallback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text('Session expired or invalid request. Please use the menu below to continue.', reply_markup=keyboard)
 
 async def main():
+    # Refuse to start on a mistyped mode instead of silently polling
+    if BOT_MODE not in ('polling', 'webhook'):
+        logging.error(f"BOT_MODE must be 'polling' or 'webhook', not {BOT_MODE!r}")
+        sys.exit(1)
+    if BOT_MODE == 'webhook' and not WEBHOOK_URL:
+        logging.error("BOT_MODE is 'webhook' but WEBHOOK_URL is not set")
+        sys.exit(1)
     init_db()
+    # Links live in SQLite; the first start imports the old links{N}.json shards
+    init_link_store()
+    write_behind.start()
 
-    # On startup, update all links_*.json and botdata.sqlite3 in Google Drive
-    if upload_or_update:
+    # On startup, back up new links and a botdata.sqlite3 snapshot if it changed since the last backup
+    # (queued for the background backup worker, so startup doesn't wait on Drive)
+    if enqueue_backup:
         try:
-            for json_file in glob('links*.json'):
-                upload_or_update(os.path.basename(json_file), os.path.abspath(json_file), folder_id=GDRIVE_FOLDER_ID)
+            schedule_link_backup(GDRIVE_FOLDER_ID, delay=0)
             if os.path.exists('botdata.sqlite3'):
-                upload_or_update('botdata.sqlite3', os.path.abspath('botdata.sqlite3'), folder_id=GDRIVE_FOLDER_ID)
+                enqueue_backup(snapshot_db(), folder_id=GDRIVE_FOLDER_ID, delay=0)
         except Exception as e:
             logging.error(f"Initial Google Drive sync failed: {e}")
 
@@ -402,12 +414,13 @@ async def main():
     def hourly_sync():
         while True:
             time.sleep(3600)  # 1 hour
-            if upload_or_update:
+            if enqueue_backup:
                 try:
-                    for json_file in glob('links*.json'):
-                        upload_or_update(os.path.basename(json_file), os.path.abspath(json_file), folder_id=GDRIVE_FOLDER_ID)
+                    schedule_link_backup(GDRIVE_FOLDER_ID, delay=0)
                     if os.path.exists('botdata.sqlite3'):
-                        upload_or_update('botdata.sqlite3', os.path.abspath('botdata.sqlite3'), folder_id=GDRIVE_FOLDER_ID)
+                        write_behind.flush()
+                        enqueue_backup(snapshot_db(), folder_id=GDRIVE_FOLDER_ID, delay=0)
+                    logging.info(format_backup_stats())
                 except Exception as e:
                     logging.error(f"Hourly Google Drive sync failed: {e}")
     def hourly_channel_alert():
@@ -464,11 +477,25 @@ async def main():
             time.sleep(3600)
     threading.Thread(target=hourly_sync, daemon=True).start()
     threading.Thread(target=hourly_channel_alert, daemon=True).start()
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+    async def post_init(application):
+        # Load the OCR model in the background once the bot is running
+        if OCR_WARM_UP:
+            application.create_task(ocr_service.warm_up())
+        if MEMBERSHIP_REVERIFY_SECONDS > 0:
+            application.create_task(membership.reverify_loop(application.bot))
+    # Every Bot API call is paced per chat and globally (see send_scheduler);
+    # updates run in parallel across users but in order per user
+    builder = ApplicationBuilder().token(BOT_TOKEN).rate_limiter(SendRateLimiter()).concurrent_updates(PerUserUpdateProcessor())
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL)
+    if TELEGRAM_BASE_FILE_URL:
+        builder = builder.base_file_url(TELEGRAM_BASE_FILE_URL)
+    app = builder.build()
 
     from telegram.ext import PreCheckoutQueryHandler
     # /start command
     app.add_handler(CommandHandler('start', start))
+    app.add_handler(CommandHandler('backupstatus', backup_status))
     # Channel join check callback
     app.add_handler(CallbackQueryHandler(check_channel_joined_callback, pattern='check_channel_joined'))
     # Accept rules
@@ -482,58 +509,69 @@ async def main():
     app.add_handler(MessageHandler(filters.SUCCESSFUL_PAYMENT, successful_payment))
     app.add_handler(PreCheckoutQueryHandler(precheckout_callback))
     # Removed global fallback handler to prevent blocking valid actions
-    await app.run_polling()
+
+    # The Application lifecycle is driven by hand on this event loop, so
+    # polling and webhook mode share the same startup and shutdown
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows: Ctrl+C raises KeyboardInterrupt instead
+    async with app:
+        await app.start()
+        await post_init(app)
+        if BOT_MODE == 'webhook':
+            import webhook_server
+            runner = await webhook_server.start(app)
+        else:
+            await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+        try:
+            await stop.wait()
+        finally:
+            if BOT_MODE == 'webhook':
+                await webhook_server.stop(runner)
+            else:
+                await app.updater.stop()
+            await app.stop()
+    async_db.shutdown()
+    write_behind.stop()
+    ocr_service.shutdown()
+    close_connections()
 async def gain_points_rules_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     # Delete the rules message before proceeding
     await query.delete_message()
-    processing_msg = await query.message.reply_text('⏳ Processing...')
     if query.data == 'gain_points_no':
-        try:
-            await context.bot.delete_message(chat_id=query.message.chat_id, message_id=processing_msg.message_id)
-        except Exception:
-            pass
         await query.message.reply_text('Returning to menu.')
         return await show_main_menu(update, context)
     elif query.data == 'gain_points_yes':
         user_id = query.from_user.id
-        from link_store import get_next_alternating_link
-        viewed = get_viewed_links(user_id)
-        last_type = context.user_data.get('last_link_type', 'user')
-        link_lists = get_next_alternating_link(user_id, viewed)
-        try:
-            await context.bot.delete_message(chat_id=query.message.chat_id, message_id=processing_msg.message_id)
-        except Exception:
-            pass
-        if not link_lists or (not link_lists['admin'] and not link_lists['user']):
-            keyboard = ReplyKeyboardMarkup([[KeyboardButton('Back to Menu')]], resize_keyboard=True)
-            await query.message.reply_text('😔 There are no links available at the moment. Please try again later!', reply_markup=keyboard)
-            return GAIN_POINTS
-        if last_type == 'user' and link_lists['admin']:
-            link = link_lists['admin'][0]
-            context.user_data['last_link_type'] = 'admin'
-        elif last_type == 'admin' and link_lists['user']:
-            link = link_lists['user'][0]
-            context.user_data['last_link_type'] = 'user'
-        elif link_lists['admin']:
-            link = link_lists['admin'][0]
-            context.user_data['last_link_type'] = 'admin'
-        elif link_lists['user']:
-            link = link_lists['user'][0]
-            context.user_data['last_link_type'] = 'user'
-        else:
+        await show_typing(context.bot, query.message.chat_id)
+        link = await pick_next_link(context, user_id)
+        if not link:
             keyboard = ReplyKeyboardMarkup([[KeyboardButton('Back to Menu')]], resize_keyboard=True)
             await query.message.reply_text('😔 There are no links available at the moment. Please try again later!', reply_markup=keyboard)
             return GAIN_POINTS
         context.user_data['current_link'] = link
         context.user_data['timer_start'] = datetime.datetime.now()
         keyboard = ReplyKeyboardMarkup([[KeyboardButton("I'm done")],[KeyboardButton('Back to Menu')]], resize_keyboard=True)
-        sent_link_msg = await query.message.reply_text(f"Visit this link: {link.get('url', 'No link available')}", reply_markup=keyboard)
-        sent_info_msg = await query.message.reply_text('When you are done, press "I\'m done".', reply_markup=keyboard)
-        context.user_data['last_link_message_ids'] = [sent_link_msg.message_id, sent_info_msg.message_id]
+        sent = await query.message.reply_text(f"Visit this link: {link.url}\n\nWhen you are done, press \"I'm done\".", reply_markup=keyboard)
+        context.user_data['last_link_message_ids'] = [sent.message_id]
         return GAIN_POINTS
 
+# /backupstatus: backup queue length and last success/error per job (admins only)
+async def backup_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if user_id not in ADMINS and not await async_db.is_admin(user_id):
+        return
+    if not format_backup_stats:
+        await update.message.reply_text('Google Drive backups are not available.')
+        return
+    await update.message.reply_text(format_backup_stats())
+
 # Add handler for inline Back to Menu button
 async def back_to_menu_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -541,15 +579,4 @@ async def back_to_menu_callback(update: Update, context: ContextTypes.DEFAULT_TY
     await show_main_menu(update, context)
 
 if __name__ == '__main__':
-    import asyncio
-    try:
-        asyncio.run(main())
-    except RuntimeError as e:
-        if 'already running' in str(e):
-            # For environments like Jupyter or where event loop is running
-            import nest_asyncio
-            nest_asyncio.apply()
-            loop = asyncio.get_event_loop()
-            loop.run_until_complete(main())
-        else:
-            raise
+    asyncio.run(main())
@@ -10,8 +10,8 @@ GDRIVE_SERVICE_ACCOUNT_JSON = os.getenv('GDRIVE_SERVICE_ACCOUNT_JSON')
 # Telegram channel link for membership check
 TELEGRAM_CHANNEL_LINK = os.getenv('TELEGRAM_CHANNEL_LINK')
 
-# List of admin Telegram IDs
-ADMINS = [6972153969, 987654321]  # Replace with real admin IDs
+# Admin Telegram IDs
+ADMINS = frozenset({6972153969, 987654321})  # Replace with real admin IDs
 
 ALLOWED_DOMAINS = [
     'youtube.com', 'youtu.be', 't.me', 'telegram.me', 'example.com'
@@ -24,3 +24,77 @@ YOUTUBE_CHANNEL_LINK = 'https://youtube.com/@panda_groups?si=1Zzwjfa6de2B96g5'
 
 # For backward compatibility (if needed elsewhere)
 YOUTUBE_GUIDE_LINK = YOUTUBE_SCREENSHOT_GUIDE_LINK
+
+# Worker threads for blocking storage calls made from async handlers
+DB_EXECUTOR_WORKERS = int(os.getenv('DB_EXECUTOR_WORKERS', '4'))
+
+# Write-behind buffer for view records and points deltas: flushed in one
+# transaction every WRITE_BEHIND_INTERVAL_MS or once WRITE_BEHIND_MAX_OPS pile up
+WRITE_BEHIND_INTERVAL_MS = int(os.getenv('WRITE_BEHIND_INTERVAL_MS', '500'))
+WRITE_BEHIND_MAX_OPS = int(os.getenv('WRITE_BEHIND_MAX_OPS', '200'))
+
+# Screenshot OCR worker pool
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '2'))
+OCR_MAX_QUEUE = int(os.getenv('OCR_MAX_QUEUE', '8'))  # jobs allowed to wait for a free worker
+OCR_TIMEOUT_SECONDS = float(os.getenv('OCR_TIMEOUT_SECONDS', '60'))
+# Fast path tries the smallest Telegram PhotoSize whose longest side is at
+# least this many pixels before falling back to the full-size photo (the
+# largest compressed size is usually 1280px, the next one down 800px)
+OCR_FAST_PHOTO_MIN_SIDE = int(os.getenv('OCR_FAST_PHOTO_MIN_SIDE', '800'))
+# Load the OCR model in the background once the bot is up instead of on the first screenshot
+OCR_WARM_UP = os.getenv('OCR_WARM_UP', '1') == '1'
+# Build the model once in a forkserver process and fork the workers from it,
+# so they share its pages copy-on-write (where forkserver exists)
+OCR_SHARE_MODEL = os.getenv('OCR_SHARE_MODEL', '1') == '1'
+
+# Perceptual-hash cache of OCR results for repeated screenshots
+OCR_CACHE_SIZE = int(os.getenv('OCR_CACHE_SIZE', '512'))  # entries kept in memory
+OCR_CACHE_DB_ROWS = int(os.getenv('OCR_CACHE_DB_ROWS', '20000'))  # rows kept in botdata.sqlite3
+OCR_HASH_MAX_DISTANCE = int(os.getenv('OCR_HASH_MAX_DISTANCE', '6'))  # bits a same-user resend may differ by
+
+# Google Drive backups: changes within this many seconds are uploaded together
+BACKUP_DEBOUNCE_SECONDS = float(os.getenv('BACKUP_DEBOUNCE_SECONDS', '30'))
+BACKUP_MAX_RETRIES = int(os.getenv('BACKUP_MAX_RETRIES', '5'))
+BACKUP_RETRY_BASE_SECONDS = float(os.getenv('BACKUP_RETRY_BASE_SECONDS', '30'))  # doubles per failed attempt
+# Links per compressed chunk file in the incremental link backup
+LINK_CHUNK_SIZE = int(os.getenv('LINK_CHUNK_SIZE', '5000'))
+
+# Per-user profiles (admin flag, points) kept in memory
+PROFILE_CACHE_SIZE = int(os.getenv('PROFILE_CACHE_SIZE', '50000'))
+
+# Channel membership cache: "member" results are reused for MEMBERSHIP_TTL_SECONDS,
+# "not a member" for MEMBERSHIP_NEGATIVE_TTL_SECONDS
+MEMBERSHIP_TTL_SECONDS = float(os.getenv('MEMBERSHIP_TTL_SECONDS', '3600'))
+MEMBERSHIP_NEGATIVE_TTL_SECONDS = float(os.getenv('MEMBERSHIP_NEGATIVE_TTL_SECONDS', '60'))
+MEMBERSHIP_CACHE_SIZE = int(os.getenv('MEMBERSHIP_CACHE_SIZE', '50000'))
+# Re-check cached members in the background this often (0 disables)
+MEMBERSHIP_REVERIFY_SECONDS = float(os.getenv('MEMBERSHIP_REVERIFY_SECONDS', '0'))
+
+# Outbound Bot API pacing (Telegram allows roughly 30 messages/s overall,
+# about 1/s per private chat and 20/min per group or channel)
+SEND_GLOBAL_PER_SECOND = float(os.getenv('SEND_GLOBAL_PER_SECOND', '30'))
+SEND_CHAT_PER_SECOND = float(os.getenv('SEND_CHAT_PER_SECOND', '1'))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', '5'))  # calls a private chat may make back to back
+SEND_GROUP_PER_MINUTE = float(os.getenv('SEND_GROUP_PER_MINUTE', '20'))
+SEND_MAX_RETRIES = int(os.getenv('SEND_MAX_RETRIES', '3'))  # retries after a RetryAfter from Telegram
+
+# How updates reach the bot: 'polling' (getUpdates) or 'webhook' (see webhook_server.py)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # public https base URL Telegram posts to
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/telegram')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')  # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+# Bot API endpoint override, e.g. a local Bot API server or a fake one for
+# end-to-end tests ('http://127.0.0.1:8081/bot'; the token is appended)
+TELEGRAM_BASE_URL = os.getenv('TELEGRAM_BASE_URL', '')
+TELEGRAM_BASE_FILE_URL = os.getenv('TELEGRAM_BASE_FILE_URL', '')
+# Update processing (see update_processor.py): different users' updates run
+# in parallel on CONCURRENT_UPDATES workers, each user's strictly in order
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '8'))
+# Updates waiting or running, counted on arrival; past either limit new
+# updates are dropped with a "busy" reply, since PTB itself queues without
+# bound. Payment updates are always admitted.
+USER_MAX_PENDING_UPDATES = int(os.getenv('USER_MAX_PENDING_UPDATES', '10'))  # from one user
+MAX_PENDING_UPDATES = int(os.getenv('MAX_PENDING_UPDATES', '256'))  # from all users together
@@ -5,11 +5,15 @@ CREATE TABLE IF NOT EXISTS viewed_links (
     PRIMARY KEY (user_id, link_id)
 );
 '''
+import gzip
+import os
+import shutil
 import sqlite3
-from contextlib import closing
-from typing import Optional
+import threading
 
 DB_PATH = 'botdata.sqlite3'
+# Compressed point-in-time copy of DB_PATH that gets uploaded as the backup
+SNAPSHOT_PATH = 'botdata.sqlite3.gz'
 
 CREATE_USERS = '''
 CREATE TABLE IF NOT EXISTS users (
@@ -20,62 +24,246 @@ CREATE TABLE IF NOT EXISTS users (
 );
 '''
 
+# id is the insertion order; link_id is the Excel-style ID shown to users
+# and stored in viewed_links
 CREATE_LINKS = '''
 CREATE TABLE IF NOT EXISTS links (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     url TEXT,
     user_id INTEGER,
     timestamp TEXT,
-    is_admin INTEGER
+    is_admin INTEGER,
+    link_id TEXT
 );
 '''
 
+CREATE_LINKS_INDEXES = [
+    'CREATE UNIQUE INDEX IF NOT EXISTS idx_links_link_id ON links (link_id)',
+    'CREATE INDEX IF NOT EXISTS idx_links_admin_id ON links (is_admin, id)',
+    'CREATE INDEX IF NOT EXISTS idx_links_user_id ON links (user_id)',
+]
+
+# Named counters, e.g. the link ID sequence used by link_store
+CREATE_SEQUENCES = '''
+CREATE TABLE IF NOT EXISTS sequences (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+# OCR results keyed by a perceptual hash of the screenshot (see ocr_cache)
+CREATE_OCR_CACHE = '''
+CREATE TABLE IF NOT EXISTS ocr_cache (
+    phash TEXT PRIMARY KEY,
+    user_id INTEGER,
+    success INTEGER,
+    fields TEXT,
+    last_used TEXT
+);
+'''
+CREATE_OCR_CACHE_INDEX = 'CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache (last_used)'
+
+# Every account that has sent a screenshot with a given perceptual hash
+CREATE_OCR_HASH_USERS = '''
+CREATE TABLE IF NOT EXISTS ocr_hash_users (
+    phash TEXT,
+    user_id INTEGER,
+    first_seen TEXT,
+    PRIMARY KEY (phash, user_id)
+);
+'''
+
+# Every account that has sent a given screenshot file, keyed by Telegram's
+# file_unique_id or the sha256 of the bytes ('uid:...' / 'sha256:...')
+CREATE_SCREENSHOT_FILES = '''
+CREATE TABLE IF NOT EXISTS screenshot_files (
+    file_key TEXT,
+    user_id INTEGER,
+    first_seen TEXT,
+    PRIMARY KEY (file_key, user_id)
+);
+'''
+
+_sequence_lock = threading.Lock()
+
+# One long-lived connection per thread (event loop, executor workers, backup
+# thread). SQLite connections must not be shared between threads mid-use, so
+# each thread lazily opens its own; WAL lets readers run alongside the writer.
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+def get_connection() -> sqlite3.Connection:
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        # check_same_thread=False only so close_connections can close it
+        conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')  # durable in WAL mode except on power loss
+        conn.execute('PRAGMA cache_size=-8000')  # 8 MB page cache
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA busy_timeout=30000')
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+    return conn
+
+def close_connections():
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _connections.clear()
+    _local.__dict__.clear()
+
+# Write a consistent, gzip-compressed copy of the live database to dest_path.
+# SQLite's online backup API copies a single point-in-time view even while
+# other threads keep writing, unlike copying botdata.sqlite3 (and its WAL)
+# off disk. The gzip header has no timestamp, so an unchanged database yields
+# a byte-identical snapshot and the change-detected upload skips it.
+def snapshot_db(dest_path=SNAPSHOT_PATH):
+    raw_path = dest_path + '.tmp.sqlite3'
+    gz_path = dest_path + '.tmp'
+    try:
+        dst = sqlite3.connect(raw_path)
+        try:
+            get_connection().backup(dst)
+        finally:
+            dst.close()
+        with open(raw_path, 'rb') as f_in, open(gz_path, 'wb') as raw_out:
+            with gzip.GzipFile(filename=os.path.basename(DB_PATH), mode='wb', fileobj=raw_out, mtime=0) as f_out:
+                shutil.copyfileobj(f_in, f_out, 1024 * 1024)
+        os.replace(gz_path, dest_path)
+    finally:
+        for path in (raw_path, gz_path):
+            if os.path.exists(path):
+                os.remove(path)
+    return dest_path
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute(CREATE_USERS)
-    c.execute(CREATE_LINKS)
-    c.execute(CREATE_VIEWED_LINKS)
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        conn.execute(CREATE_USERS)
+        conn.execute(CREATE_LINKS)
+        # Databases created before links moved into SQLite lack link_id
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(links)')]
+        if 'link_id' not in columns:
+            conn.execute('ALTER TABLE links ADD COLUMN link_id TEXT')
+        for statement in CREATE_LINKS_INDEXES:
+            conn.execute(statement)
+        conn.execute(CREATE_VIEWED_LINKS)
+        conn.execute(CREATE_SEQUENCES)
+        conn.execute(CREATE_OCR_CACHE)
+        conn.execute(CREATE_OCR_CACHE_INDEX)
+        conn.execute(CREATE_OCR_HASH_USERS)
+        conn.execute(CREATE_SCREENSHOT_FILES)
+# Schema version kept in PRAGMA user_version, for one-shot data migrations
+def get_schema_version() -> int:
+    return get_connection().execute('PRAGMA user_version').fetchone()[0]
+
+def set_schema_version(version: int):
+    get_connection().execute(f'PRAGMA user_version = {int(version)}')
+
 # Record that a user has viewed a link
 def add_viewed_link(user_id, link_id):
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        c = conn.cursor()
-        c.execute('''INSERT OR IGNORE INTO viewed_links (user_id, link_id) VALUES (?, ?)''', (user_id, link_id))
-        conn.commit()
-
-# Get all link_ids viewed by a user
-def get_viewed_links(user_id):
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        c = conn.cursor()
-        c.execute('''SELECT link_id FROM viewed_links WHERE user_id = ?''', (user_id,))
-        return set(row[0] for row in c.fetchall())
-        conn.commit()
+    conn = get_connection()
+    with conn:
+        conn.execute('''INSERT OR IGNORE INTO viewed_links (user_id, link_id) VALUES (?, ?)''', (user_id, link_id))
+
+# Whether a user has viewed a link; a primary-key lookup, independent of how much they have viewed
+def has_viewed(user_id, link_id) -> bool:
+    c = get_connection().execute('''SELECT 1 FROM viewed_links WHERE user_id = ? AND link_id = ?''', (user_id, link_id))
+    return c.fetchone() is not None
 
 def add_user(telegram_id, username, is_admin=0):
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        c = conn.cursor()
-        c.execute('''INSERT OR IGNORE INTO users (telegram_id, username, is_admin) VALUES (?, ?, ?)''',
-                  (telegram_id, username, is_admin))
-        conn.commit()
+    conn = get_connection()
+    with conn:
+        conn.execute('''INSERT OR IGNORE INTO users (telegram_id, username, is_admin) VALUES (?, ?, ?)''',
+                     (telegram_id, username, is_admin))
 
 def update_points(telegram_id, delta):
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        c = conn.cursor()
-        c.execute('''UPDATE users SET points = points + ? WHERE telegram_id = ?''', (delta, telegram_id))
-        conn.commit()
-
-def get_points(telegram_id) -> Optional[float]:
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        c = conn.cursor()
-        c.execute('''SELECT points FROM users WHERE telegram_id = ?''', (telegram_id,))
-        row = c.fetchone()
-        return row[0] if row else None
-
-def is_admin(telegram_id) -> bool:
-    with closing(sqlite3.connect(DB_PATH)) as conn:
-        c = conn.cursor()
-        c.execute('''SELECT is_admin FROM users WHERE telegram_id = ?''', (telegram_id,))
-        row = c.fetchone()
-        return bool(row[0]) if row else False
+    conn = get_connection()
+    with conn:
+        conn.execute('''UPDATE users SET points = points + ? WHERE telegram_id = ?''', (delta, telegram_id))
+
+def get_user(telegram_id):
+    # (points, is_admin) in one lookup, or None for users not in the table
+    row = get_connection().execute('''SELECT points, is_admin FROM users WHERE telegram_id = ?''', (telegram_id,)).fetchone()
+    return (row[0], bool(row[1])) if row else None
+
+# Atomically bump and return a named counter. The counter never drops below
+# `floor`, so it can be seeded from data that already exists. BEGIN IMMEDIATE
+# takes the write lock up front, so concurrent callers (threads or processes)
+# always get distinct values.
+def next_sequence_value(name, floor=0) -> int:
+    conn = get_connection()
+    with _sequence_lock:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('''INSERT OR IGNORE INTO sequences (name, value) VALUES (?, ?)''', (name, floor))
+            conn.execute('''UPDATE sequences SET value = MAX(value, ?) + 1 WHERE name = ?''', (floor, name))
+            value = conn.execute('''SELECT value FROM sequences WHERE name = ?''', (name,)).fetchone()[0]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return value
+
+# Apply buffered writes in a single transaction: views is a list of
+# (user_id, link_id), points a list of (delta, telegram_id)
+def apply_batch(views, points):
+    conn = get_connection()
+    with conn:
+        if views:
+            conn.executemany('''INSERT OR IGNORE INTO viewed_links (user_id, link_id) VALUES (?, ?)''', views)
+        if points:
+            conn.executemany('''UPDATE users SET points = points + ? WHERE telegram_id = ?''', points)
+
+def get_ocr_result(phash):
+    # Returns (user_id, success, fields_json) or None
+    c = get_connection().execute('''SELECT user_id, success, fields FROM ocr_cache WHERE phash = ?''', (phash,))
+    return c.fetchone()
+
+def get_recent_ocr_results(limit):
+    # Most recently used first: (phash, user_id, success, fields_json)
+    c = get_connection().execute('''SELECT phash, user_id, success, fields FROM ocr_cache ORDER BY last_used DESC LIMIT ?''', (limit,))
+    return c.fetchall()
+
+def save_ocr_result(phash, user_id, success, fields_json, max_rows):
+    conn = get_connection()
+    with conn:
+        conn.execute('''INSERT OR REPLACE INTO ocr_cache (phash, user_id, success, fields, last_used) VALUES (?, ?, ?, ?, datetime('now'))''',
+                     (phash, user_id, int(success), fields_json))
+        # Trim the least recently used rows only once the cap is exceeded
+        excess = conn.execute('SELECT COUNT(*) FROM ocr_cache').fetchone()[0] - max_rows
+        if excess > 0:
+            conn.execute('''DELETE FROM ocr_cache WHERE phash IN (SELECT phash FROM ocr_cache ORDER BY last_used LIMIT ?)''', (excess,))
+
+def touch_ocr_result(phash):
+    conn = get_connection()
+    with conn:
+        conn.execute('''UPDATE ocr_cache SET last_used = datetime('now') WHERE phash = ?''', (phash,))
+
+# Record that user_id sent a screenshot with these file keys; returns the other
+# accounts that sent the same file before this user first did (rowids grow
+# with insertion order), so the original sender is never the one turned away
+def record_screenshot_file(file_keys, user_id):
+    conn = get_connection()
+    others = set()
+    with conn:
+        for key in file_keys:
+            conn.execute('''INSERT OR IGNORE INTO screenshot_files (file_key, user_id, first_seen) VALUES (?, ?, datetime('now'))''', (key, user_id))
+            c = conn.execute('''SELECT user_id FROM screenshot_files WHERE file_key = ? AND user_id != ? AND rowid <
+                             (SELECT rowid FROM screenshot_files WHERE file_key = ? AND user_id = ?)''', (key, user_id, key, user_id))
+            others.update(row[0] for row in c.fetchall())
+    return sorted(others)
+
+# Record that user_id sent a screenshot with this hash; returns the other accounts that sent it too
+def record_screenshot_hash(phash, user_id):
+    conn = get_connection()
+    with conn:
+        conn.execute('''INSERT OR IGNORE INTO ocr_hash_users (phash, user_id, first_seen) VALUES (?, ?, datetime('now'))''', (phash, user_id))
+        c = conn.execute('''SELECT user_id FROM ocr_hash_users WHERE phash = ? AND user_id != ?''', (phash, user_id))
+        return [row[0] for row in c.fetchall()]
@@ -1,19 +1,72 @@
+import hashlib
+import json
 import os
 import pickle
+import threading
+import time
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from googleapiclient.http import MediaFileUpload
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 
+from config import BACKUP_DEBOUNCE_SECONDS, BACKUP_MAX_RETRIES, BACKUP_RETRY_BASE_SECONDS
+
 # Google Drive API scope: allow read/write to your files
 SCOPES = ['https://www.googleapis.com/auth/drive.file']
 
+# Per-file backup state: {filename: {'file_id', 'sha256', 'mtime_ns', 'size'}}.
+# Lets upload_if_changed skip unchanged files and the files().list lookup.
+BACKUP_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backup_state.json')
+_state_lock = threading.Lock()
+_state = None
+
+# Process-wide Drive client. Building it from discovery is expensive, so it is
+# built once and reused; the credentials are refreshed in place when the token
+# expires. The client itself is not thread-safe, which is fine since uploads
+# only run on the backup worker thread.
+_service = None
+_creds = None
+_service_lock = threading.Lock()
+
 
 def get_drive_service():
-    """Authenticate and return Google Drive service"""
+    """Return the cached Google Drive service, authenticating only when needed"""
+    import logging
+    global _service, _creds
+    with _service_lock:
+        if _service is not None and _creds.valid:
+            return _service
+        if _service is not None and _creds.expired and _creds.refresh_token:
+            try:
+                _creds.refresh(Request())
+                _save_token(_creds)
+                return _service
+            except Exception as e:
+                logging.error(f"Failed to refresh credentials: {e}")
+        _creds = _load_credentials()
+        _service = build('drive', 'v3', credentials=_creds, cache_discovery=False)
+        return _service
+
+
+def _token_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'token.pickle')
+
+
+def _save_token(creds):
+    import logging
+    try:
+        with open(_token_path(), 'wb') as token:
+            pickle.dump(creds, token)
+    except Exception as e:
+        logging.warning(f"Could not save token.pickle: {e}")
+
+
+def _load_credentials():
+    """Load token.pickle, refreshing it or running the OAuth flow if needed"""
     import logging
     base_dir = os.path.dirname(os.path.abspath(__file__))
-    token_path = os.path.join(base_dir, 'token.pickle')
+    token_path = _token_path()
     creds_path = os.path.join(base_dir, 'credentials.json')
     creds = None
     if os.path.exists(token_path):
@@ -40,23 +93,30 @@ def get_drive_service():
             except Exception as e:
                 logging.error(f"Google auth failed: {e}")
                 raise
-            try:
-                with open(token_path, 'wb') as token:
-                    pickle.dump(creds, token)
-            except Exception as e:
-                logging.warning(f"Could not save token.pickle: {e}")
+            _save_token(creds)
 
-    return build('drive', 'v3', credentials=creds)
+    return creds
 
 
-def upload_or_update(filename, filepath, folder_id=None):
-    """Upload new file or update existing one in Google Drive"""
+def upload_or_update(filename, filepath, folder_id=None, file_id=None, raise_errors=False):
+    """Upload new file or update existing one in Google Drive; returns its Drive file ID"""
     import logging
     if not os.path.exists(filepath):
         logging.warning(f"File not found for upload: {filepath}")
-        return
+        return None
     try:
         service = get_drive_service()
+        if file_id:
+            # Known Drive file: update it directly, skipping the lookup
+            try:
+                media = MediaFileUpload(filepath, resumable=True)
+                service.files().update(fileId=file_id, media_body=media).execute()
+                print(f"🔄 Updated {filename} in Google Drive")
+                return file_id
+            except HttpError as e:
+                if e.resp.status != 404:
+                    raise
+                logging.warning(f"Cached Drive ID for {filename} is gone, looking it up again")
         # Check if file already exists
         query = f"name='{filename}'"
         if folder_id:
@@ -75,6 +135,166 @@ def upload_or_update(filename, filepath, folder_id=None):
         else:
             # Upload new file
             file = service.files().create(body=file_metadata, media_body=media, fields='id').execute()
-            print(f"✅ Uploaded {filename} to Google Drive (ID: {file.get('id')})")
+            file_id = file.get('id')
+            print(f"✅ Uploaded {filename} to Google Drive (ID: {file_id})")
+        return file_id
     except Exception as e:
+        if raise_errors:
+            raise
         logging.error(f"Failed to upload/update {filename}: {e}")
+        return None
+
+
+def _load_state():
+    global _state
+    if _state is None:
+        _state = {}
+        if os.path.exists(BACKUP_STATE_PATH):
+            try:
+                with open(BACKUP_STATE_PATH, 'r', encoding='utf-8') as f:
+                    _state = json.load(f)
+            except Exception:
+                _state = {}
+    return _state
+
+
+def _save_state():
+    tmp_path = BACKUP_STATE_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_state, f)
+    os.replace(tmp_path, BACKUP_STATE_PATH)
+
+
+def _file_digest(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def upload_if_changed(filename, filepath, folder_id=None):
+    """Upload only if the file changed since its last successful backup; returns True if uploaded.
+    Upload errors are raised so the caller can retry."""
+    if not os.path.exists(filepath):
+        return False
+    stat = os.stat(filepath)
+    with _state_lock:
+        entry = dict(_load_state().get(filename, {}))
+    # Same mtime and size: unchanged, no need to hash
+    if entry.get('mtime_ns') == stat.st_mtime_ns and entry.get('size') == stat.st_size:
+        return False
+    digest = _file_digest(filepath)
+    uploaded = False
+    if entry.get('sha256') != digest:
+        entry['file_id'] = upload_or_update(filename, filepath, folder_id, file_id=entry.get('file_id'), raise_errors=True)
+        uploaded = True
+    entry.update(sha256=digest, mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+    with _state_lock:
+        _load_state()[filename] = entry
+        _save_state()
+    return uploaded
+
+
+# Background backup queue. Handlers enqueue jobs and return immediately; a
+# single worker thread runs them. A job queued again under the same name before
+# it runs is coalesced into the pending entry, and each entry waits
+# BACKUP_DEBOUNCE_SECONDS so a burst of posts costs one upload. Failed jobs
+# are retried with exponential backoff.
+_queue_cond = threading.Condition()
+_pending = {}  # name -> {'action', 'due', 'attempts'}
+_worker = None
+_last_success = {}  # name -> unix time of last successful run
+_last_error = {}  # name -> (unix time, message)
+
+
+def enqueue_job(name, action, delay=None):
+    """Queue action() to run on the backup worker; it should raise on failure to be retried"""
+    global _worker
+    due = time.time() + (BACKUP_DEBOUNCE_SECONDS if delay is None else delay)
+    with _queue_cond:
+        entry = _pending.get(name)
+        if entry:
+            entry['due'] = min(entry['due'], due)
+        else:
+            _pending[name] = {'action': action, 'due': due, 'attempts': 0}
+        if _worker is None:
+            _worker = threading.Thread(target=_worker_loop, name='gdrive-backup', daemon=True)
+            _worker.start()
+        _queue_cond.notify()
+
+
+def enqueue_backup(filepath, folder_id=None, filename=None, delay=None):
+    """Queue a change-detected upload of filepath; never blocks on the network"""
+    filename = filename or os.path.basename(filepath)
+    filepath = os.path.abspath(filepath)
+    enqueue_job(filename, lambda: upload_if_changed(filename, filepath, folder_id), delay)
+
+
+def _next_due():
+    # Called with _queue_cond held: pop entries whose time has come
+    now = time.time()
+    due = [(name, entry) for name, entry in _pending.items() if entry['due'] <= now]
+    for name, _ in due:
+        del _pending[name]
+    return due
+
+
+def _worker_loop():
+    import logging
+    while True:
+        with _queue_cond:
+            batch = _next_due()
+            while not batch:
+                timeout = min((e['due'] for e in _pending.values()), default=None)
+                _queue_cond.wait(None if timeout is None else max(0, timeout - time.time()))
+                batch = _next_due()
+        for name, entry in batch:
+            try:
+                entry['action']()
+                _last_success[name] = time.time()
+                _last_error.pop(name, None)
+            except Exception as e:
+                _last_error[name] = (time.time(), str(e))
+                attempts = entry['attempts'] + 1
+                if attempts > BACKUP_MAX_RETRIES:
+                    logging.error(f"Giving up on backup of {name} after {attempts} attempts: {e}")
+                    continue
+                delay = min(BACKUP_RETRY_BASE_SECONDS * 2 ** (attempts - 1), 3600)
+                logging.warning(f"Backup of {name} failed ({e}), retrying in {delay:.0f}s")
+                with _queue_cond:
+                    # A newer request for the same job already covers this retry
+                    if name not in _pending:
+                        _pending[name] = dict(entry, attempts=attempts, due=time.time() + delay)
+
+
+def queue_length():
+    with _queue_cond:
+        return len(_pending)
+
+
+def backup_stats():
+    """Pending jobs plus last success / last error per job"""
+    with _queue_cond:
+        pending = {name: {'due': e['due'], 'attempts': e['attempts']} for name, e in _pending.items()}
+    return {'queue_length': len(pending), 'pending': pending,
+            'last_success': dict(_last_success), 'last_error': dict(_last_error)}
+
+
+def format_backup_stats():
+    # One line per job, for the log and the /backupstatus admin command
+    stats = backup_stats()
+    now = time.time()
+    lines = [f"Backup queue: {stats['queue_length']} pending"]
+    for name in sorted(set(stats['pending']) | set(stats['last_success']) | set(stats['last_error'])):
+        parts = []
+        if name in stats['pending']:
+            entry = stats['pending'][name]
+            parts.append(f"due in {max(0, entry['due'] - now):.0f}s (attempt {entry['attempts'] + 1})")
+        if name in stats['last_success']:
+            parts.append(f"last ok {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stats['last_success'][name]))}")
+        if name in stats['last_error']:
+            when, message = stats['last_error'][name]
+            parts.append(f"last error {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(when))}: {message}")
+        lines.append(f"{name}: " + '; '.join(parts))
+    return '\n'.join(lines)
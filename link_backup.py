@@ -0,0 +1,80 @@
+import gzip
+import json
+import os
+import re
+from typing import List
+
+from config import LINK_CHUNK_SIZE
+from link_store import load_links_since
+
+# Incremental link backup. Instead of re-uploading whole links{N}.json shards,
+# links are written to gzip'd JSON-lines chunk files of LINK_CHUNK_SIZE links,
+# links_{seq}.jsonl.gz holding the links from row id seq on. Each line
+# carries its row id ('seq'), so the next export picks up after the last one
+# written (row ids grow but can have gaps, so they are not positions). Only
+# the last (open) chunk is rewritten as links arrive, under the same name, so
+# on Drive it updates one file in place; full chunks never change again. The
+# number of files therefore grows with the number of links, not with the
+# number of backup runs. restore_links.py rebuilds the shards from them.
+CHUNK_DIR = 'link_chunks'
+_CHUNK_RE = re.compile(r'^links_(\d{8})\.jsonl\.gz$')
+
+def _chunk_name(seq):
+    return f'links_{seq:08d}.jsonl.gz'
+
+def list_chunks(chunk_dir=CHUNK_DIR) -> List[tuple]:
+    # (first seq, path) for every chunk, in order
+    chunks = []
+    if os.path.isdir(chunk_dir):
+        for name in os.listdir(chunk_dir):
+            m = _CHUNK_RE.match(name)
+            if m:
+                chunks.append((int(m.group(1)), os.path.join(chunk_dir, name)))
+    return sorted(chunks)
+
+def read_chunk(path) -> List[dict]:
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def _write_chunk(path, records):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as raw_out:
+        with gzip.GzipFile(filename=os.path.basename(path)[:-3], mode='wb', fileobj=raw_out, mtime=0) as f:
+            for record in records:
+                f.write((json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8'))
+    os.replace(tmp_path, path)
+
+def export_new_links(chunk_dir=CHUNK_DIR) -> List[str]:
+    """Write the chunk files that gained links since the last export; returns their paths"""
+    chunks = list_chunks(chunk_dir)
+    records, last_seq = [], 0
+    if chunks:
+        records = read_chunk(chunks[-1][1])
+        last_seq = records[-1]['seq'] if records else chunks[-1][0] - 1
+        if len(records) >= LINK_CHUNK_SIZE:
+            # Last chunk is full; new links start the next one
+            records = []
+    new_links = load_links_since(last_seq)
+    if not new_links:
+        return []
+    records += [dict(link.to_dict(), seq=link.seq) for link in new_links]
+    os.makedirs(chunk_dir, exist_ok=True)
+    paths = []
+    for offset in range(0, len(records), LINK_CHUNK_SIZE):
+        chunk = records[offset:offset + LINK_CHUNK_SIZE]
+        path = os.path.join(chunk_dir, _chunk_name(chunk[0]['seq']))
+        _write_chunk(path, chunk)
+        paths.append(path)
+    return paths
+
+def backup_new_links(folder_id=None):
+    """Export new links and upload every chunk not yet on Drive; raises on upload failure"""
+    from gdrive_backup import upload_if_changed
+    export_new_links()
+    for _, path in list_chunks():
+        upload_if_changed(os.path.basename(path), os.path.abspath(path), folder_id)
+
+def schedule_link_backup(folder_id=None, delay=None):
+    """Queue an incremental link backup on the background backup worker"""
+    from gdrive_backup import enqueue_job
+    enqueue_job('link-chunks', lambda: backup_new_links(folder_id), delay)
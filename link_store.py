@@ -1,5 +1,7 @@
 import re
 
+from db import get_connection, get_schema_version, set_schema_version, next_sequence_value
+
 def normalize_opera_link(url: str) -> str:
     # If already short, return as is
     m = re.match(r'https://opr\.news/([\w]+)\?', url)
@@ -12,44 +14,74 @@ def normalize_opera_link(url: str) -> str:
         return short
     return url
 
+# Excel-style IDs: a, b, ..., z, aa, ab, ..., az, ba, ... (a = 1)
+def alpha_to_int(s: str) -> int:
+    s = s.lower()
+    if not s or set(s) - set('abcdefghijklmnopqrstuvwxyz'):
+        return 0
+    n = 0
+    for c in s:
+        n = n * 26 + (ord(c) - ord('a') + 1)
+    return n
+
+def int_to_alpha(n: int) -> str:
+    res = ''
+    while n > 0:
+        n, r = divmod(n - 1, 26)
+        res = chr(ord('a') + r) + res
+    return res
+
 def get_next_link_id() -> str:
-    links = load_links()
-    if not links:
-        return 'a'
-    last_id = links[-1].get('id', 'a')
-    # Excel-style increment: a, b, ..., z, aa, ab, ..., az, ba, ...
-    def next_alpha(s):
-        s = s.lower()
-        if set(s) - set('abcdefghijklmnopqrstuvwxyz'):
-            return 'a'
-        n = 0
-        for c in s:
-            n = n * 26 + (ord(c) - ord('a') + 1)
-        n += 1
-        res = ''
-        while n > 0:
-            n, r = divmod(n - 1, 26)
-            res = chr(ord('a') + r) + res
-        return res
-    return next_alpha(last_id)
+    # Allocated from a persisted counter in botdata.sqlite3 so concurrent posts
+    # never share an ID. The newest stored link only seeds the counter.
+    row = get_connection().execute('''SELECT link_id FROM links ORDER BY id DESC LIMIT 1''').fetchone()
+    last_id = row[0] if row and row[0] else ''
+    return int_to_alpha(next_sequence_value('link_id', floor=alpha_to_int(str(last_id))))
 # Alternate admin/user links for a user, skipping already viewed and own links
 def get_next_alternating_link(user_id, viewed_ids):
-    links = load_links()
-    admin_links = [l for l in links if l.get('is_admin') and l.get('user_id') != user_id and l.get('id') not in viewed_ids]
-    user_links = [l for l in links if not l.get('is_admin') and l.get('user_id') != user_id and l.get('id') not in viewed_ids]
-    # Use context or a global to track last type shown if needed; here, just alternate by count
-    # If admin links remain, show one, then user, then admin, etc.
-    # If one type is exhausted, show only the other
-    if not admin_links and not user_links:
+    # Kept for older callers: returns the next eligible link of each type
+    # (at most one per list) instead of every unseen link
+    admin_link = _next_eligible(user_id, 'admin', viewed_ids)
+    user_link = _next_eligible(user_id, 'user', viewed_ids)
+    if not admin_link and not user_link:
         return None
-    # Alternate: if more admin links left, show admin, else user
-    # For strict alternation, the bot should track last type shown per user in user_data
-    # Here, return both lists for the bot to alternate
-    return {'admin': admin_links, 'user': user_links}
+    return {'admin': [admin_link] if admin_link else [], 'user': [user_link] if user_link else []}
+
+def get_next_link_for_user(user_id, viewed_ids, last_type='user'):
+    # Views already in viewed_links are excluded by the query itself;
+    # viewed_ids only needs to support `in` and covers views not yet stored
+    # (e.g. write_behind.ViewedLinks).
+    # Returns (link, link_type) or (None, None). After a user link show an
+    # admin link if one is left, and vice versa; if one type is exhausted,
+    # fall back to the other.
+    preferred = 'admin' if last_type == 'user' else 'user'
+    fallback = 'user' if preferred == 'admin' else 'admin'
+    for link_type in (preferred, fallback):
+        link = _next_eligible(user_id, link_type, viewed_ids)
+        if link:
+            return link, link_type
+    return None, None
 import json
+import logging
 import random
 import os
-from typing import List, Dict
+import threading
+from typing import List, Dict, Optional
+
+# Links live in the links table of botdata.sqlite3 (see db.CREATE_LINKS).
+# Selection walks the (is_admin, id) index and checks viewed_links by primary
+# key, so no call scans every link.
+LINK_COLUMNS = 'id, link_id, url, user_id, timestamp, is_admin'
+
+# Per-user cursors: every link of that type with id <= cursor is known to be
+# the user's own or viewed. Links are only ever appended and never become
+# eligible again, so the next search can start after the cursor.
+_cursor_lock = threading.Lock()
+_cursors: Dict[int, Dict[str, int]] = {}
+
+# Legacy JSON storage, read once by migrate_json_links
+SHARD_SIZE = 10000
+LINKS_SCHEMA_VERSION = 1
 
 def _get_links_file_index():
     # Find the highest index file that exists
@@ -58,12 +90,7 @@ def _get_links_file_index():
         idx += 1
     return idx - 1 if idx > 1 else 1
 
-def _get_links_file(idx=None):
-    if idx is None:
-        idx = _get_links_file_index()
-    return f'links{idx}.json'
-
-def load_links() -> List[Dict]:
+def _read_shards() -> List[Dict]:
     # Load all links from all files
     links = []
     idx = 1
@@ -83,37 +110,143 @@ def load_links() -> List[Dict]:
                 pass
     return links
 
+def _write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+# Compact record for a stored link: slots instead of a per-link dict, and the
+# timestamp kept as the stored ISO string (never parsed). The ID stays the
+# Excel-style string users see and viewed_links stores; seq is the integer key.
+class Link:
+    __slots__ = ('seq', 'id', 'url', 'user_id', 'timestamp', 'is_admin')
+
+    def __init__(self, seq: int, id: str, url: str, user_id: int, timestamp: str, is_admin: bool):
+        self.seq = seq  # row id in the links table: insertion order
+        self.id = id
+        self.url = url
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.is_admin = is_admin
+
+    def to_dict(self) -> Dict:
+        return {'id': self.id, 'url': self.url, 'user_id': self.user_id, 'timestamp': self.timestamp, 'is_admin': self.is_admin}
+
+    def __repr__(self):
+        return f'Link(id={self.id!r}, url={self.url!r}, user_id={self.user_id!r}, is_admin={self.is_admin!r})'
+
+def _row_to_link(row) -> Link:
+    return Link(row[0], row[1], row[2], row[3], row[4], bool(row[5]))
+
+def _insert_link(conn, link: Dict):
+    conn.execute('''INSERT OR IGNORE INTO links (link_id, url, user_id, timestamp, is_admin) VALUES (?, ?, ?, ?, ?)''',
+                 (link.get('id'), link.get('url'), link.get('user_id'), link.get('timestamp'), int(bool(link.get('is_admin')))))
+
+def migrate_json_links():
+    # One-shot import of the links{N}.json shards into SQLite, in their
+    # original order. The JSON files are left in place. The old ID allocation
+    # could hand two posts the same ID; the second one gets a fresh ID (after
+    # all imported ones) instead of being dropped. An exact repeat of a link
+    # is skipped. The links and the schema version are committed together, so
+    # an interrupted import is redone from scratch, never on top of itself.
+    if get_schema_version() >= LINKS_SCHEMA_VERSION:
+        return
+    seen = {}  # link ID -> (url, user_id, timestamp) of the link that kept it
+    links, duplicates = [], []
+    for link in _read_shards():
+        content = (link.get('url'), link.get('user_id'), link.get('timestamp'))
+        kept = seen.get(link.get('id'))
+        if kept is None:
+            seen[link.get('id')] = content
+            links.append(link)
+        elif kept != content:
+            duplicates.append(link)
+    if duplicates:
+        floor = max(alpha_to_int(str(link_id)) for link_id in seen)
+        # Allocated up front: next_sequence_value commits on its own, and an
+        # interrupted import only leaves unused IDs behind
+        for link in duplicates:
+            new_id = int_to_alpha(next_sequence_value('link_id', floor=floor))
+            logging.warning(f"Link ID {link.get('id')!r} of user {link.get('user_id')} was already taken; imported as {new_id!r}")
+            links.append(dict(link, id=new_id))
+        logging.warning(f"Re-numbered {len(duplicates)} links with duplicate IDs while importing the JSON links")
+    conn = get_connection()
+    with conn:
+        for link in links:
+            _insert_link(conn, link)
+        set_schema_version(LINKS_SCHEMA_VERSION)
+
+def init_link_store():
+    # Called at startup, after db.init_db()
+    migrate_json_links()
+    with _cursor_lock:
+        _cursors.clear()
+
+def _next_eligible(user_id, link_type, viewed_ids):
+    # First link of this type after the user's cursor that is neither their
+    # own nor in viewed_links. Links in viewed_ids are skipped as well. The
+    # cursor moves up to just before the result, which is not consumed and is
+    # offered again until the user views it.
+    is_admin = 1 if link_type == 'admin' else 0
+    with _cursor_lock:
+        cursor = _cursors.setdefault(user_id, {'admin': 0, 'user': 0})[link_type]
+    conn = get_connection()
+    while True:
+        row = conn.execute(
+            f'''SELECT {LINK_COLUMNS} FROM links l
+            WHERE is_admin = ? AND id > ? AND user_id != ?
+              AND NOT EXISTS (SELECT 1 FROM viewed_links v WHERE v.user_id = ? AND v.link_id = l.link_id)
+            ORDER BY id LIMIT 1''',
+            (is_admin, cursor, user_id, user_id)).fetchone()
+        if row is None or row[1] not in viewed_ids:
+            break
+        cursor = row[0]
+    with _cursor_lock:
+        cursors = _cursors[user_id]
+        new_cursor = row[0] - 1 if row else cursor
+        cursors[link_type] = max(cursors[link_type], new_cursor)
+    return _row_to_link(row) if row else None
+
+def load_links() -> List[Link]:
+    rows = get_connection().execute(f'''SELECT {LINK_COLUMNS} FROM links ORDER BY id''').fetchall()
+    return [_row_to_link(row) for row in rows]
+
+def load_links_since(seq: int) -> List[Link]:
+    # Links with a row id (Link.seq) above `seq`, in the order they were added
+    rows = get_connection().execute(f'''SELECT {LINK_COLUMNS} FROM links WHERE id > ? ORDER BY id''', (seq,)).fetchall()
+    return [_row_to_link(row) for row in rows]
+
 def save_links(links: List[Dict], idx=None):
+    # Writes a legacy links{N}.json shard (used by restore tooling)
     if idx is None:
         idx = _get_links_file_index()
-    with open(f'links{idx}.json', 'w', encoding='utf-8') as f:
-        json.dump(links, f, ensure_ascii=False, indent=2)
+    _write_json_atomic(f'links{idx}.json', links)
 
 def add_link(link: Dict):
-    idx = _get_links_file_index()
-    links = []
-    # Load current file
-    if os.path.exists(f'links{idx}.json'):
-        with open(f'links{idx}.json', 'r', encoding='utf-8') as f:
-            try:
-                links = json.load(f)
-            except Exception:
-                links = []
-    # If file is full, increment idx
-    if len(links) >= 10000:
-        idx += 1
-        links = []
-    links.append(link)
-    save_links(links, idx)
-
-def get_random_link(admin_links: bool, admin_ratio=0.6) -> Dict:
-    links = load_links()
-    admin = [l for l in links if l.get('is_admin')]
-    regular = [l for l in links if not l.get('is_admin')]
+    conn = get_connection()
+    with conn:
+        _insert_link(conn, link)
+
+def _random_link_of_type(is_admin: int):
+    # Pick a random point in the (is_admin, id) index and take the next link
+    conn = get_connection()
+    low, high = conn.execute('''SELECT MIN(id), MAX(id) FROM links WHERE is_admin = ?''', (is_admin,)).fetchone()
+    if low is None:
+        return None
+    row = conn.execute(f'''SELECT {LINK_COLUMNS} FROM links WHERE is_admin = ? AND id >= ? ORDER BY id LIMIT 1''',
+                       (is_admin, random.randint(low, high))).fetchone()
+    return _row_to_link(row)
+
+def get_random_link(admin_links: bool, admin_ratio=0.6) -> Optional[Link]:
+    admin = _random_link_of_type(1)
+    regular = _random_link_of_type(0)
     if admin_links and admin and (random.random() < admin_ratio or not regular):
-        return random.choice(admin)
+        return admin
     elif regular:
-        return random.choice(regular)
+        return regular
     elif admin:
-        return random.choice(admin)
-    return {}
+        return admin
+    return None
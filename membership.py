@@ -0,0 +1,56 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from config import (TELEGRAM_CHANNEL_LINK, MEMBERSHIP_TTL_SECONDS, MEMBERSHIP_NEGATIVE_TTL_SECONDS,
+                    MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_REVERIFY_SECONDS)
+
+# Channel membership results from get_chat_member, cached per user so repeat
+# /starts answer from memory. "Not a member" expires much sooner than
+# "member", and the "I Joined" button drops the entry before re-checking.
+# Failed lookups are not cached. Only touched from the event loop, so no lock.
+MEMBER_STATUSES = ('member', 'administrator', 'creator')
+
+_cache = OrderedDict()  # user_id -> (is_member, expires_at)
+
+def _remember(user_id, member):
+    ttl = MEMBERSHIP_TTL_SECONDS if member else MEMBERSHIP_NEGATIVE_TTL_SECONDS
+    _cache[user_id] = (member, time.monotonic() + ttl)
+    _cache.move_to_end(user_id)
+    while len(_cache) > MEMBERSHIP_CACHE_SIZE:
+        _cache.popitem(last=False)
+
+async def _fetch(bot, user_id) -> bool:
+    member = await bot.get_chat_member(TELEGRAM_CHANNEL_LINK, user_id)
+    result = member.status in MEMBER_STATUSES
+    _remember(user_id, result)
+    return result
+
+async def is_member(bot, user_id) -> bool:
+    """Whether the user is in the channel; raises if Telegram can't be asked."""
+    entry = _cache.get(user_id)
+    if entry and entry[1] > time.monotonic():
+        return entry[0]
+    return await _fetch(bot, user_id)
+
+def invalidate(user_id):
+    _cache.pop(user_id, None)
+
+async def reverify_loop(bot):
+    # Every MEMBERSHIP_REVERIFY_SECONDS, re-check cached members whose entry
+    # would expire before the next round, so active users keep hitting the
+    # cache and anyone who left the channel is noticed. Negative entries are
+    # left to expire.
+    while True:
+        await asyncio.sleep(MEMBERSHIP_REVERIFY_SECONDS)
+        horizon = time.monotonic() + MEMBERSHIP_REVERIFY_SECONDS
+        due = [user_id for user_id, (member, expires_at) in _cache.items() if member and expires_at <= horizon]
+        for user_id in due:
+            try:
+                await _fetch(bot, user_id)
+            except Exception as e:
+                logging.debug(f"Membership re-check for {user_id} failed: {e}")
+            await asyncio.sleep(0.05)  # spread the calls out
+        if due:
+            logging.info(f"Re-verified channel membership for {len(due)} users")
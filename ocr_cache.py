@@ -0,0 +1,88 @@
+import hashlib
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+import db
+from config import OCR_CACHE_SIZE, OCR_CACHE_DB_ROWS, OCR_HASH_MAX_DISTANCE
+from ocr_utils import image_dhash
+
+# OCR results keyed by a perceptual hash (dHash) of the screenshot, so a
+# re-sent screenshot skips OCR entirely. Recent entries live in an in-memory
+# LRU; all of them are persisted in botdata.sqlite3 (capped at
+# OCR_CACHE_DB_ROWS) and survive restarts.
+#
+# An exact hash hit is reused for anyone: another account re-sending the same
+# file was already turned away by reused_by_other_accounts, and a different
+# image with the same hash must show the same screen. A near match (within
+# OCR_HASH_MAX_DISTANCE bits) is only reused for the same user: two accounts'
+# settings screens look alike apart from the Installation ID, so their hashes
+# can be close without being the same screenshot. For the same reason a hash
+# shared across accounts is only logged, never grounds for rejection. A near
+# match is also only reused if OCR succeeded on it: a user retaking a failed
+# screenshot gets a fresh OCR rather than the old failure.
+_lock = threading.Lock()
+_lru = OrderedDict()  # phash -> (user_id, success, found)
+_loaded = False
+
+def _ensure_loaded():
+    global _loaded
+    if _loaded:
+        return
+    for phash, user_id, success, fields in reversed(db.get_recent_ocr_results(OCR_CACHE_SIZE)):
+        _lru[phash] = (user_id, bool(success), json.loads(fields))
+    _loaded = True
+
+def _remember(phash, entry):
+    _lru[phash] = entry
+    _lru.move_to_end(phash)
+    while len(_lru) > OCR_CACHE_SIZE:
+        _lru.popitem(last=False)
+
+def image_hash(image_bytes) -> str:
+    return image_dhash(image_bytes)
+
+def lookup(phash, user_id):
+    """Cached (success, found) for this screenshot, or None."""
+    with _lock:
+        _ensure_loaded()
+        entry = _lru.get(phash)
+        if entry is None:
+            row = db.get_ocr_result(phash)
+            if row:
+                entry = (row[0], bool(row[1]), json.loads(row[2]))
+        if entry is None:
+            target = int(phash, 16)
+            for other_hash, other in _lru.items():
+                if other[0] == user_id and other[1] and (int(other_hash, 16) ^ target).bit_count() <= OCR_HASH_MAX_DISTANCE:
+                    phash, entry = other_hash, other
+                    break
+        if entry is None:
+            return None
+        _remember(phash, entry)
+        db.touch_ocr_result(phash)
+        return entry[1], entry[2]
+
+def store(phash, user_id, success, found):
+    with _lock:
+        _ensure_loaded()
+        _remember(phash, (user_id, success, found))
+        db.save_ocr_result(phash, user_id, success, json.dumps(found), OCR_CACHE_DB_ROWS)
+
+def reused_by_other_accounts(image_bytes, file_unique_id, user_id):
+    """Record this user against the exact file; returns other accounts that sent the same file."""
+    keys = ['sha256:' + hashlib.sha256(image_bytes).hexdigest()]
+    if file_unique_id:
+        keys.append('uid:' + file_unique_id)
+    others = db.record_screenshot_file(keys, user_id)
+    if others:
+        logging.warning(f"Screenshot file from user {user_id} was already sent by {others}")
+    return others
+
+def flag_similar_screenshots(phash, user_id):
+    """Record this user against the hash; logs (only) other accounts whose screenshot hashed the same."""
+    others = db.record_screenshot_hash(phash, user_id)
+    if others:
+        logging.warning(f"Screenshot {phash[:16]}... from user {user_id} has the same hash as one from {others}; flagged for review")
+    return others
@@ -0,0 +1,22 @@
+import logging
+
+# Imported once by the OCR forkserver process (see ocr_service): builds the
+# EasyOCR model there, so every worker forked from it shares the model's
+# pages copy-on-write instead of loading a private copy.
+#
+# torch is kept to one thread before the model loads, so the server doesn't
+# start intra-op thread pools just to hand them to its children; torch resets
+# its pools in a forked child in any case.
+try:
+    import torch
+    torch.set_num_threads(1)
+except ImportError:
+    pass
+
+try:
+    from ocr_utils import get_reader
+    get_reader()
+except Exception as e:
+    # The forkserver would die on an import error here; the workers then
+    # load the model themselves in _init_worker
+    logging.warning(f"OCR model preload failed: {e}")
@@ -0,0 +1,150 @@
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import OCR_WORKERS, OCR_MAX_QUEUE, OCR_TIMEOUT_SECONDS, OCR_SHARE_MODEL
+
+# Screenshot OCR runs in a process pool so EasyOCR's seconds of CPU work never
+# block the event loop. At most OCR_WORKERS jobs run at once and at most
+# OCR_MAX_QUEUE more may wait; beyond that callers get OCRBusyError instead of
+# piling up behind each other.
+#
+# Nothing is loaded at startup: the pool and the model are built off the
+# event loop on the first job or by warm_up(), so the bot polls right away.
+# With OCR_SHARE_MODEL the workers come from a forkserver, a fresh
+# single-purpose process that imports ocr_preload (building the model once)
+# and forks each worker from itself, so they share the model's pages. The bot
+# process is never forked, whatever threads it runs. Without forkserver on
+# this platform, or with sharing off, workers are spawned and each loads its
+# own model.
+
+class OCRBusyError(Exception):
+    """Raised when the OCR queue is full."""
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_future = None  # asyncio future of a pool being built off the event loop
+_in_flight = 0  # submitted jobs that have not finished (running + waiting)
+_in_flight_lock = threading.Lock()
+
+def _init_worker():
+    # Load the model as each worker starts (a no-op if it was inherited from
+    # the forkserver), and keep torch to one thread per process so the workers
+    # don't oversubscribe the CPU
+    try:
+        import torch
+        torch.set_num_threads(1)
+    except ImportError:
+        pass
+    from ocr_utils import get_reader
+    get_reader()
+
+def _ocr_job(image, fast, full_pass):
+    from ocr_utils import extract_fields_from_image
+    return extract_fields_from_image(image, fast=fast, full_pass=full_pass)
+
+def _warm_job():
+    return True
+
+def _mp_context():
+    if OCR_SHARE_MODEL and 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['ocr_preload'])
+        return context
+    return multiprocessing.get_context('spawn')
+
+def _build_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS, initializer=_init_worker,
+                                        mp_context=_mp_context())
+        return _pool
+
+async def _get_pool() -> ProcessPoolExecutor:
+    # Starting processes takes a while, so it happens in a thread; concurrent
+    # callers all wait on the same build
+    global _pool_future
+    if _pool is not None:
+        return _pool
+    if _pool_future is None:
+        _pool_future = asyncio.get_running_loop().run_in_executor(None, _build_pool)
+    future = _pool_future
+    try:
+        # Shielded: one caller timing out must not cancel the build for the rest
+        return await asyncio.shield(future)
+    finally:
+        if _pool_future is future and future.done():
+            _pool_future = None
+
+def _discard_pool(pool):
+    # A worker died (e.g. OOM-killed mid-OCR), which breaks the whole pool;
+    # drop it so the next job starts a fresh one
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    logging.error("OCR worker pool broke; it will be restarted on the next job")
+
+def _job_done(_future):
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight -= 1
+
+def queue_depth() -> int:
+    # Jobs waiting for a free worker
+    return max(0, _in_flight - OCR_WORKERS)
+
+async def extract_fields(image, timeout=OCR_TIMEOUT_SECONDS, fast=True, full_pass=True):
+    """OCR a screenshot in the worker pool; returns (success, found_fields).
+
+    Raises OCRBusyError if the queue is full, asyncio.TimeoutError if the
+    job takes longer than `timeout` seconds (a job still waiting is dropped)
+    and BrokenProcessPool if a worker died.
+    """
+    global _in_flight
+    with _in_flight_lock:
+        if _in_flight >= OCR_WORKERS + OCR_MAX_QUEUE:
+            raise OCRBusyError(f"OCR queue full ({_in_flight} jobs in flight)")
+        _in_flight += 1
+    pool = None
+    try:
+        pool = await _get_pool()
+        future = pool.submit(_ocr_job, image, fast, full_pass)
+    except Exception as e:
+        _job_done(None)
+        if isinstance(e, BrokenProcessPool):
+            _discard_pool(pool)
+        raise
+    future.add_done_callback(_job_done)
+    logging.info(f"OCR job queued: {_in_flight} in flight, queue depth {queue_depth()}")
+    try:
+        return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except BrokenProcessPool:
+        _discard_pool(pool)
+        raise
+
+async def warm_up():
+    # Start the pool and load the model off the event loop, so the first
+    # screenshot doesn't pay for it
+    pool = None
+    try:
+        pool = await _get_pool()
+        await asyncio.gather(*[asyncio.wrap_future(pool.submit(_warm_job)) for _ in range(OCR_WORKERS)])
+        logging.info("OCR workers warmed up")
+    except BrokenProcessPool:
+        _discard_pool(pool)
+    except Exception as e:
+        logging.warning(f"OCR warm-up failed: {e}")
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
@@ -1,18 +1,60 @@
-import easyocr
 import re
-from typing import Tuple
+import threading
+from typing import Tuple, Union
 
-reader = easyocr.Reader(['en'], gpu=False)
+import cv2
+import numpy as np
 
-# Returns (success, found_fields)
-def extract_fields_from_image(image_path: str) -> Tuple[bool, dict]:
-    result = reader.readtext(image_path, detail=0)
-    text = ' '.join(result)
-    found = {
-        'Installation ID': None,
-        'Version': None,
-        'Sign Out': False
-    }
+# The EasyOCR model is only built on first use (or by an explicit warm-up);
+# importing easyocr pulls in torch, so even the import is deferred.
+_reader = None
+_reader_lock = threading.Lock()
+
+def get_reader():
+    global _reader
+    if _reader is None:
+        with _reader_lock:
+            if _reader is None:
+                import easyocr
+                _reader = easyocr.Reader(['en'], gpu=False)
+    return _reader
+
+# Decode an encoded image (JPEG/PNG bytes) straight into the BGR array
+# reader.readtext accepts, without a temp file
+def decode_image(data: Union[bytes, bytearray]) -> np.ndarray:
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError("Could not decode image data")
+    return image
+
+# Difference hash of an encoded image as a hex string (hash_size**2 bits).
+# Near-identical screenshots (re-sent, recompressed, resized) hash to the same
+# or a close value. The JPEG is decoded at 1/8 scale since only a thumbnail is needed.
+def image_dhash(data: Union[bytes, bytearray], hash_size: int = 16) -> str:
+    image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if image is None:
+        raise ValueError("Could not decode image data")
+    small = cv2.resize(image, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return f'{value:0{hash_size * hash_size // 4}x}'
+
+# Longest side of the grayscale image used for the fast first pass; the
+# settings-screen text is still legible at this size
+FAST_MAX_SIDE = 640
+
+def _fast_variant(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    height, width = image.shape[:2]
+    scale = FAST_MAX_SIDE / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    return image
+
+def _scan_lines(result, found):
     for line in result:
         if 'installation id' in line.lower():
             found['Installation ID'] = line
@@ -20,5 +62,30 @@ def extract_fields_from_image(image_path: str) -> Tuple[bool, dict]:
             found['Version'] = line
         if 'sign out' in line.lower():
             found['Sign Out'] = True
-    success = all([found['Installation ID'], found['Version'], found['Sign Out']])
-    return success, found
+
+def _all_found(found) -> bool:
+    return all([found['Installation ID'], found['Version'], found['Sign Out']])
+
+# Returns (success, found_fields); image may be a file path, encoded bytes or a decoded array.
+# With fast=True a downscaled grayscale pass runs first, and the full-resolution
+# pass only runs if that one misses a field (and full_pass is set; callers with
+# a larger copy of the photo retry with that instead).
+def extract_fields_from_image(image: Union[str, bytes, bytearray, np.ndarray], fast: bool = True,
+                              full_pass: bool = True) -> Tuple[bool, dict]:
+    if isinstance(image, (bytes, bytearray)):
+        image = decode_image(image)
+    elif isinstance(image, str):
+        image = cv2.imread(image)
+        if image is None:
+            raise ValueError("Could not read image file")
+    found = {
+        'Installation ID': None,
+        'Version': None,
+        'Sign Out': False
+    }
+    if fast:
+        _scan_lines(get_reader().readtext(_fast_variant(image), detail=0), found)
+        if _all_found(found) or not full_pass:
+            return _all_found(found), found
+    _scan_lines(get_reader().readtext(image, detail=0), found)
+    return _all_found(found), found
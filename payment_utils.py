@@ -1,4 +1,4 @@
-from db import update_points
+import async_db
 from telegram.ext import ContextTypes
 
 async def precheckout_callback(update, context: ContextTypes.DEFAULT_TYPE):
@@ -11,7 +11,7 @@ async def successful_payment(update, context: ContextTypes.DEFAULT_TYPE):
     total_amount = payment.total_amount  # in the smallest currency unit (stars)
     from payment_utils import POINTS_PRICE_PER_UNIT
     points_to_add = total_amount // POINTS_PRICE_PER_UNIT
-    update_points(user.id, points_to_add)
+    await async_db.credit_points(user.id, points_to_add)
     await update.message.reply_text(f"Payment successful! {points_to_add} point(s) have been added to your account.")
     from bot import show_main_menu
     await show_main_menu(update, context)
@@ -0,0 +1,74 @@
+import threading
+from collections import OrderedDict
+
+import db
+import write_behind
+from config import PROFILE_CACHE_SIZE
+
+# Per-user profile cache: admin flag, points, and whether the user is verified
+# at all (has a users row). A miss costs one indexed lookup; after that the
+# handlers read from memory. Points changes and new users are written through
+# here, so the cache never goes stale. Nothing else writes the users table
+# while the bot runs.
+#
+# _lock is held across a load and a write-through, so a points delta can't
+# land between reading a profile and caching it.
+_lock = threading.Lock()
+_profiles = OrderedDict()  # telegram_id -> Profile, or None if not verified
+
+class Profile:
+    __slots__ = ('points', 'is_admin')
+
+    def __init__(self, points, is_admin):
+        self.points = points
+        self.is_admin = is_admin
+
+def _load(telegram_id):
+    user = write_behind.get_user(telegram_id)
+    return Profile(*user) if user else None
+
+def _remember(telegram_id, profile):
+    _profiles[telegram_id] = profile
+    _profiles.move_to_end(telegram_id)
+    while len(_profiles) > PROFILE_CACHE_SIZE:
+        _profiles.popitem(last=False)
+
+def get_profile(telegram_id):
+    """The user's Profile, or None if they haven't passed verification."""
+    with _lock:
+        if telegram_id in _profiles:
+            _profiles.move_to_end(telegram_id)
+            return _profiles[telegram_id]
+        profile = _load(telegram_id)
+        _remember(telegram_id, profile)
+        return profile
+
+def get_points(telegram_id):
+    profile = get_profile(telegram_id)
+    return profile.points if profile else None
+
+def is_admin(telegram_id) -> bool:
+    profile = get_profile(telegram_id)
+    return profile.is_admin if profile else False
+
+def update_points(telegram_id, delta):
+    with _lock:
+        write_behind.update_points(telegram_id, delta)
+        profile = _profiles.get(telegram_id)
+        if profile is not None:
+            profile.points += delta
+
+def credit_points(telegram_id, delta):
+    # Committed before returning, bypassing the write-behind buffer: paid
+    # points must survive a crash right after the user is told they arrived
+    with _lock:
+        db.update_points(telegram_id, delta)
+        profile = _profiles.get(telegram_id)
+        if profile is not None:
+            profile.points += delta
+
+def add_user(telegram_id, username, is_admin=0):
+    # INSERT OR IGNORE keeps an existing row as it is, so re-read it
+    with _lock:
+        db.add_user(telegram_id, username, is_admin)
+        _remember(telegram_id, _load(telegram_id))
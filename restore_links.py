@@ -0,0 +1,41 @@
+import json
+import os
+import sys
+
+from link_backup import CHUNK_DIR, list_chunks, read_chunk
+from link_store import SHARD_SIZE
+
+# Rebuild links{N}.json shards from the chunk files written by link_backup.
+# Usage: python restore_links.py [chunk_dir] [output_dir]
+# Download the links_*.jsonl.gz chunks from Drive into chunk_dir first. To load
+# the result into a fresh botdata.sqlite3, put the shards next to bot.py; they
+# are imported on the first start (link_store.migrate_json_links).
+
+def read_chunks(chunk_dir):
+    # Links in row-id order; the 'seq' each line carries is dropped again
+    links = []
+    seen = set()
+    last_seq = 0
+    for start, path in list_chunks(chunk_dir):
+        if start <= last_seq:
+            raise SystemExit(f"Overlapping chunks: {os.path.basename(path)} starts at or before row {last_seq}")
+        for link in read_chunk(path):
+            last_seq = link.pop('seq')
+            if link.get('id') not in seen:
+                seen.add(link.get('id'))
+                links.append(link)
+    return links
+
+def main():
+    chunk_dir = sys.argv[1] if len(sys.argv) > 1 else CHUNK_DIR
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else 'restored_links'
+    links = read_chunks(chunk_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    shards = [links[i:i + SHARD_SIZE] for i in range(0, len(links), SHARD_SIZE)]
+    for idx, shard in enumerate(shards, start=1):
+        with open(os.path.join(output_dir, f'links{idx}.json'), 'w', encoding='utf-8') as f:
+            json.dump(shard, f, ensure_ascii=False, indent=2)
+    print(f"Restored {len(links)} links into {len(shards)} shard(s) in {output_dir}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import threading
+import time
+
+from telegram.constants import ChatAction
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import (SEND_GLOBAL_PER_SECOND, SEND_CHAT_PER_SECOND, SEND_CHAT_BURST,
+                    SEND_GROUP_PER_MINUTE, SEND_MAX_RETRIES)
+
+# Paces every Bot API call against Telegram's flood limits: a global token
+# bucket (about 30 requests/s) plus, for calls that post into a chat, one per
+# chat (about 1/s in private chats with short bursts, 20/min in groups and
+# channels). Read-only calls that merely name a chat, such as getChatMember
+# on the channel, only count globally. Each call reserves a token and sleeps
+# until it is due, so a burst queues up instead of failing. A RetryAfter from
+# Telegram is waited out and the call retried.
+#
+# Buckets are guarded by a threading lock rather than asyncio primitives:
+# the channel alert thread drives app.bot from its own event loop.
+
+# Bot API methods that post into, edit or delete from the chat they name
+# (sendMessage, sendChatAction, editMessageText, deleteMessage, copyMessage, ...)
+_CHAT_ENDPOINT_PREFIXES = ('send', 'edit', 'delete', 'copy', 'forward')
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, now) -> float:
+        # Take a token, going into debt if none is left; returns the wait
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self, now) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+class SendRateLimiter(BaseRateLimiter):
+    MAX_CHAT_BUCKETS = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._global = TokenBucket(SEND_GLOBAL_PER_SECOND, SEND_GLOBAL_PER_SECOND)
+        self._chats = {}
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _chat_bucket(self, chat_id, now):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                # A full bucket holds no state worth keeping
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle(now)}
+            # Private chats have positive ids; groups, channels and @names don't
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(SEND_CHAT_PER_SECOND, SEND_CHAT_BURST)
+            else:
+                bucket = TokenBucket(SEND_GROUP_PER_MINUTE / 60, 1)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _reserve(self, chat_id) -> float:
+        with self._lock:
+            now = time.monotonic()
+            delay = self._global.reserve(now)
+            if chat_id is not None:
+                delay = max(delay, self._chat_bucket(chat_id, now).reserve(now))
+            return delay
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id') if endpoint.startswith(_CHAT_ENDPOINT_PREFIXES) else None
+        retries = 0
+        while True:
+            delay = self._reserve(chat_id)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                retries += 1
+                if retries > SEND_MAX_RETRIES:
+                    raise
+                logging.warning(f"Flood limit hit on {endpoint}; retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+
+async def delete_messages(bot, chat_id, message_ids):
+    # Best-effort cleanup of several messages. Bot API 7.0 deleteMessages takes
+    # up to 100 ids per call (PTB 20.8+); older PTB deletes them one by one,
+    # concurrently, paced by the rate limiter.
+    message_ids = [message_id for message_id in message_ids if message_id]
+    if not message_ids:
+        return
+    if hasattr(bot, 'delete_messages'):
+        for i in range(0, len(message_ids), 100):
+            try:
+                await bot.delete_messages(chat_id=chat_id, message_ids=message_ids[i:i + 100])
+            except Exception:
+                pass
+        return
+    await asyncio.gather(*(bot.delete_message(chat_id=chat_id, message_id=message_id) for message_id in message_ids),
+                         return_exceptions=True)
+
+async def show_typing(bot, chat_id):
+    # Replaces the old "⏳ Processing..." message: one call, nothing to delete
+    try:
+        await bot.send_chat_action(chat_id=chat_id, action=ChatAction.TYPING)
+    except Exception:
+        pass
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from config import CONCURRENT_UPDATES, USER_MAX_PENDING_UPDATES, MAX_PENDING_UPDATES
+
+# Runs updates from different users in parallel while each user's own updates
+# run one at a time, in the order they arrived. Handlers keep per-user state
+# in context.user_data (current_link, timer_start, last_link_type), which two
+# concurrent updates from the same user would race on.
+#
+# PTB 20.7 starts a task for every fetched update without limit and only then
+# calls process_update, whose semaphore (max_concurrent_updates) would hold
+# updates where they can't be counted. That semaphore is therefore left wide
+# open and admission happens here, as each update arrives: beyond
+# MAX_PENDING_UPDATES updates waiting or running in total, or
+# USER_MAX_PENDING_UPDATES from one user, further updates are dropped
+# instead of queueing without bound. The user is told to try again: a dropped
+# button press is answered with a notice, a dropped message gets one reply
+# until one of their updates is admitted again. Payment updates are never
+# dropped, since the payment would be lost with them. The worker semaphore is
+# only taken once it is the user's turn, so a user with a backlog never holds
+# workers that other users could use.
+_UNBOUNDED = 2 ** 30
+BUSY_TEXT = "⏳ The bot is busy right now. Please try again in a moment."
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self):
+        super().__init__(max_concurrent_updates=_UNBOUNDED)
+        self._workers = asyncio.Semaphore(CONCURRENT_UPDATES)
+        self._locks = {}  # user_id -> asyncio.Lock, while the user has updates in flight
+        self._pending = {}  # user_id -> updates waiting or running
+        self._total = 0  # all updates waiting or running
+        self._told_busy = set()  # users already sent a busy reply since their last admitted update
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @staticmethod
+    def _user_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    @staticmethod
+    def _is_payment(update):
+        return isinstance(update, Update) and bool(
+            update.pre_checkout_query or (update.message and update.message.successful_payment))
+
+    async def _drop(self, update, key, coroutine, reason):
+        logging.warning(f"Dropping update from {key}: {reason}")
+        coroutine.close()
+        if not isinstance(update, Update):
+            return
+        try:
+            if update.callback_query:
+                await update.callback_query.answer(BUSY_TEXT)
+            elif update.effective_message and key is not None and key not in self._told_busy:
+                self._told_busy.add(key)
+                await update.effective_message.reply_text(BUSY_TEXT)
+        except Exception as e:
+            logging.warning(f"Could not send the busy reply to {key}: {e}")
+
+    async def do_process_update(self, update, coroutine):
+        key = self._user_key(update)
+        if not self._is_payment(update):
+            if self._total >= MAX_PENDING_UPDATES:
+                await self._drop(update, key, coroutine, f"{MAX_PENDING_UPDATES} updates already pending")
+                return
+            if key is not None and self._pending.get(key, 0) >= USER_MAX_PENDING_UPDATES:
+                await self._drop(update, key, coroutine, f"{USER_MAX_PENDING_UPDATES} already queued")
+                return
+        self._told_busy.discard(key)
+        self._total += 1
+        try:
+            if key is None:
+                async with self._workers:
+                    await coroutine
+                return
+            self._pending[key] = self._pending.get(key, 0) + 1
+            lock = self._locks.setdefault(key, asyncio.Lock())
+            try:
+                async with lock:
+                    async with self._workers:
+                        await coroutine
+            finally:
+                self._pending[key] -= 1
+                if not self._pending[key]:
+                    del self._pending[key]
+                    del self._locks[key]
+        finally:
+            self._total -= 1
+            if not self._total:
+                self._told_busy.clear()
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import sys
+
+# End-to-end check of webhook mode against a fake Telegram Bot API on localhost:
+# no token, network or public URL needed.
+# Usage: python webhook_e2e.py
+#
+# The fake API records every Bot API call. The bot is built the way bot.py
+# builds it (TELEGRAM_BASE_URL, SendRateLimiter, PerUserUpdateProcessor) and
+# served by webhook_server. The check then posts updates the way Telegram
+# would and verifies:
+#   - setWebhook was called with WEBHOOK_URL + WEBHOOK_PATH and the secret;
+#   - a request without the secret header is refused;
+#   - an update reaches its handler, whose reply arrives at the fake API;
+#   - two updates from one user are handled in order.
+FAKE_API_PORT = int(os.getenv('FAKE_API_PORT', '18081'))
+os.environ.setdefault('BOT_MODE', 'webhook')
+os.environ.setdefault('WEBHOOK_LISTEN', '127.0.0.1')
+os.environ.setdefault('WEBHOOK_PORT', '18443')
+os.environ.setdefault('WEBHOOK_URL', f"http://127.0.0.1:{os.environ['WEBHOOK_PORT']}")
+os.environ.setdefault('WEBHOOK_SECRET', 'e2e-secret')
+os.environ.setdefault('TELEGRAM_BASE_URL', f'http://127.0.0.1:{FAKE_API_PORT}/bot')
+
+from aiohttp import web, ClientSession
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+
+import webhook_server
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, TELEGRAM_BASE_URL
+from send_scheduler import SendRateLimiter
+from update_processor import PerUserUpdateProcessor
+
+calls = []  # (method, params) in the order the fake API received them
+
+async def fake_api(request):
+    method = request.match_info['method']
+    if request.content_type == 'application/json':
+        params = await request.json()
+    else:
+        params = dict(await request.post())
+    calls.append((method, params))
+    if method == 'getMe':
+        result = {'id': 1, 'is_bot': True, 'first_name': 'Panda Clicker', 'username': 'e2e_bot'}
+    elif method == 'sendMessage':
+        chat_id = int(params['chat_id'])
+        result = {'message_id': len(calls), 'date': 0, 'chat': {'id': chat_id, 'type': 'private'}, 'text': params['text']}
+    else:
+        result = True
+    return web.json_response({'ok': True, 'result': result})
+
+def make_update(update_id, user_id, text):
+    entities = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}] if text.startswith('/') else []
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': 0, 'text': text, 'entities': entities,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': 'e2e'}}}
+
+async def run():
+    fake = web.AppRunner(web.Application())
+    fake.app.router.add_post('/bot{token}/{method}', fake_api)
+    await fake.setup()
+    await web.TCPSite(fake, '127.0.0.1', FAKE_API_PORT).start()
+
+    app = (ApplicationBuilder().token('123:e2e').base_url(TELEGRAM_BASE_URL)
+           .rate_limiter(SendRateLimiter()).concurrent_updates(PerUserUpdateProcessor()).build())
+
+    async def start(update, context):
+        await update.message.reply_text('welcome')
+
+    async def echo(update, context):
+        await asyncio.sleep(0.2 if update.message.text == 'first' else 0)
+        await update.message.reply_text(f'echo: {update.message.text}')
+
+    app.add_handler(CommandHandler('start', start))
+    app.add_handler(MessageHandler(filters.TEXT, echo))
+
+    failures = []
+    def check(ok, what):
+        print(('PASS ' if ok else 'FAIL ') + what)
+        if not ok:
+            failures.append(what)
+
+    url = f'http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}'
+    headers = {webhook_server.SECRET_HEADER: WEBHOOK_SECRET}
+    async with app:
+        await app.start()
+        runner = await webhook_server.start(app)
+        try:
+            webhook = [params for method, params in calls if method == 'setWebhook']
+            check(bool(webhook) and webhook[0].get('url') == WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH
+                  and webhook[0].get('secret_token') == (WEBHOOK_SECRET or None), 'setWebhook registers the webhook URL and secret')
+            async with ClientSession() as session:
+                if WEBHOOK_SECRET:
+                    async with session.post(url, json=make_update(1, 42, '/start')) as response:
+                        check(response.status == 403, 'update without the secret header is refused')
+                async with session.post(url, json=make_update(2, 42, '/start'), headers=headers) as response:
+                    check(response.status == 200, 'update with the secret header is accepted')
+                for update_id, text in ((3, 'first'), (4, 'second')):
+                    async with session.post(url, json=make_update(update_id, 42, text), headers=headers) as response:
+                        check(response.status == 200, f'update {text!r} is accepted')
+            for _ in range(50):
+                if len([1 for method, _ in calls if method == 'sendMessage']) >= 3:
+                    break
+                await asyncio.sleep(0.1)
+            replies = [params['text'] for method, params in calls if method == 'sendMessage']
+            check(replies == ['welcome', 'echo: first', 'echo: second'], f'replies arrive once and in order: {replies}')
+        finally:
+            await webhook_server.stop(runner)
+            await app.stop()
+    await fake.cleanup()
+    return not failures
+
+if __name__ == '__main__':
+    sys.exit(0 if asyncio.run(run()) else 1)
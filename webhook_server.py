@@ -0,0 +1,51 @@
+import hmac
+import logging
+
+from aiohttp import web
+from telegram import Update
+
+from config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_LISTEN, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_MAX_CONNECTIONS
+
+# Webhook mode (BOT_MODE=webhook): a small aiohttp server receives updates
+# from Telegram and puts them on the Application's update_queue, the same
+# queue long polling feeds. Telegram gets its 200 as soon as the update is
+# queued; handlers run afterwards under the Application's update processing.
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+def _make_web_app(application):
+    async def receive_update(request):
+        if WEBHOOK_SECRET and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ''), WEBHOOK_SECRET):
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        await application.update_queue.put(Update.de_json(data, application.bot))
+        return web.Response()
+
+    async def health(request):
+        return web.Response(text='ok')
+
+    web_app = web.Application()
+    web_app.router.add_post(WEBHOOK_PATH, receive_update)
+    web_app.router.add_get('/healthz', health)
+    return web_app
+
+async def start(application) -> web.AppRunner:
+    # Start listening, then point Telegram at WEBHOOK_URL + WEBHOOK_PATH
+    if not WEBHOOK_URL:
+        raise ValueError("WEBHOOK_URL must be set in webhook mode")
+    runner = web.AppRunner(_make_web_app(application))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+    await application.bot.set_webhook(
+        url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET or None,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=Update.ALL_TYPES,
+    )
+    logging.info(f"Webhook server listening on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    return runner
+
+async def stop(runner):
+    await runner.cleanup()
@@ -0,0 +1,103 @@
+import atexit
+import logging
+import threading
+
+import db
+from config import WRITE_BEHIND_INTERVAL_MS, WRITE_BEHIND_MAX_OPS
+
+# Write-behind buffer for the per-click writes (viewed_links inserts and
+# points deltas). They are queued in memory and flushed together in one
+# transaction, instead of one commit/fsync each. Reads go through get_user
+# and ViewedLinks, which overlay the pending writes so users see their
+# credit immediately.
+#
+# _lock is held across a flush, so a reader never sees a delta that is both
+# gone from the buffer and not yet committed.
+_lock = threading.Lock()
+_pending_views = {}  # user_id -> set of link_ids
+_pending_points = {}  # telegram_id -> summed delta
+_pending_ops = 0
+_wakeup = threading.Event()
+_stopping = threading.Event()
+_thread = None
+
+def add_viewed_link(user_id, link_id):
+    global _pending_ops
+    with _lock:
+        _pending_views.setdefault(user_id, set()).add(link_id)
+        _pending_ops += 1
+        if _pending_ops >= WRITE_BEHIND_MAX_OPS:
+            _wakeup.set()
+
+def update_points(telegram_id, delta):
+    global _pending_ops
+    with _lock:
+        _pending_points[telegram_id] = _pending_points.get(telegram_id, 0) + delta
+        _pending_ops += 1
+        if _pending_ops >= WRITE_BEHIND_MAX_OPS:
+            _wakeup.set()
+
+def get_user(telegram_id):
+    # (points, is_admin) with pending deltas applied, or None
+    with _lock:
+        user = db.get_user(telegram_id)
+        if user is None:
+            return None
+        return user[0] + _pending_points.get(telegram_id, 0), user[1]
+
+class ViewedLinks:
+    """Set-like view of one user's viewed links where `in` is an indexed lookup.
+
+    Checking the pending buffer before the database is race-free without the
+    lock: a flush only moves a view from the buffer into the database.
+    """
+    __slots__ = ('user_id',)
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def __contains__(self, link_id):
+        pending = _pending_views.get(self.user_id)
+        if pending is not None and link_id in pending:
+            return True
+        return db.has_viewed(self.user_id, link_id)
+
+def flush():
+    global _pending_ops
+    with _lock:
+        if not _pending_ops:
+            return
+        views = [(user_id, link_id) for user_id, ids in _pending_views.items() for link_id in ids]
+        points = [(delta, telegram_id) for telegram_id, delta in _pending_points.items()]
+        db.apply_batch(views, points)
+        _pending_views.clear()
+        _pending_points.clear()
+        _pending_ops = 0
+
+def _run():
+    while not _stopping.is_set():
+        _wakeup.wait(WRITE_BEHIND_INTERVAL_MS / 1000)
+        _wakeup.clear()
+        try:
+            flush()
+        except Exception as e:
+            # Pending writes stay buffered and are retried on the next tick
+            logging.error(f"Write-behind flush failed: {e}")
+
+def start():
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_run, name='write-behind', daemon=True)
+        _thread.start()
+
+def stop():
+    # Flush whatever is left; safe to call more than once
+    global _thread
+    _stopping.set()
+    _wakeup.set()
+    if _thread is not None:
+        _thread.join()
+        _thread = None
+    flush()
+
+atexit.register(stop)